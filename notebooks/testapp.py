@@ -1,17 +1,17 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+from client import LookupClient
 
 # MUST BE FIRST STREAMLIT COMMAND
 st.set_page_config(page_title="Contractor Profile Lookup", layout="wide")
 
 # === FILE LOCATIONS ===
 EXCEL_METADATA = "Data Sources.xlsx"
-CONTRACTOR_REGISTRY = "cleaned_contractors.csv"
-AWARDED_CONTRACTS = "Matched_Contracts.csv"
-NYC_AWARDS = "Cleaned_NYC_Awarded_Contracts.csv"
-WAGE_THEFT = "cleaned_construction_nywagetheft.xlsx"
-APPRENTICE = "cleaned_apprentice.xlsx"
 
 # === DISPLAY COLUMN MAP (per sheet) ===
 display_column_map = {
@@ -22,18 +22,17 @@ display_column_map = {
 }
 
 # === LOAD DATA ===
+# source records come from the lookup service (python src/service.py), only display metadata is local
 @st.cache_data
-def load_all_data():
-    return {
-        "registry": pd.read_csv(CONTRACTOR_REGISTRY, dtype=str),
-        "contracts": pd.read_csv(AWARDED_CONTRACTS, dtype=str),
-        "awards": pd.read_csv(NYC_AWARDS, dtype=str),
-        "wagetheft": pd.read_excel(WAGE_THEFT, dtype=str),
-        "apprentice": pd.read_excel(APPRENTICE, dtype=str),
-        "metadata": pd.read_excel(EXCEL_METADATA, sheet_name=None)
-    }
-
-data = load_all_data()
+def load_metadata():
+    return pd.read_excel(EXCEL_METADATA, sheet_name=None)
+
+@st.cache_resource
+def get_client():
+    return LookupClient()
+
+metadata = load_metadata()
+client = get_client()
 
 # === TITLE ===
 st.title("\U0001F3D7\uFE0F Contractor Profile Lookup")
@@ -47,27 +46,31 @@ if "selected_business" not in st.session_state:
 
 # === SEARCH LOGIC ===
 if search_term:
-    df_registry = data["registry"]
-    if search_option == "Business Name":
-        matches = df_registry[df_registry["Business Name"].str.contains(search_term, na=False, case=False)]
-    else:
-        matches = df_registry[df_registry["Address"].str.contains(search_term, na=False, case=False)]
-
-    if not matches.empty:
-        st.session_state.business_list = matches["Business Name"].dropna().unique()
+    # names: substring search like the original registry filter, addresses: the parsed address index;
+    # profiles then come from the matched entity
+    matches = client.search(search_term, "name" if search_option == "Business Name" else "address")
+
+    if matches:
+        businesses = pd.concat(matches.values()).drop_duplicates("COMPANY_ID")
+        labels = dict(zip(businesses["COMPANY_ID"], businesses["NAME1"].str.upper()))
+        st.session_state.business_list = list(labels)
         if len(st.session_state.business_list) > 1:
-            st.session_state.selected_business = st.selectbox("Multiple matches found. Please select one:", st.session_state.business_list)
+            st.session_state.selected_business = st.selectbox("Multiple matches found. Please select one:", st.session_state.business_list, format_func=labels.get)
         else:
             st.session_state.selected_business = st.session_state.business_list[0]
+        st.session_state.business_labels = labels
     else:
         st.warning("No matches found.")
 
 # === PROFILE OUTPUT ===
-if st.session_state.selected_business:
-    selected_name = st.session_state.selected_business
+if st.session_state.selected_business is not None:
+    selected_name = st.session_state.business_labels[st.session_state.selected_business]
     st.subheader(f"\U0001F4CC Profile for: {selected_name}")
 
-    row = data["registry"][data["registry"]["Business Name"] == selected_name].iloc[0]
+    profile = client.profile(st.session_state.selected_business)
+    sources = {k: v.fillna("").astype(str) for k, v in profile["sources"].items()}
+    registry = sources.get("REGISTRY", pd.DataFrame())
+    row = registry.iloc[0] if not registry.empty else pd.Series(dtype=str)
 
     # === VIOLATION FLAGS AT TOP ===
     flags = []
@@ -86,7 +89,7 @@ if st.session_state.selected_business:
 
     # === 1. Contractor Registry ===
     with st.expander("\U0001F3E2 Business Registration Details"):
-        sheet = data["metadata"]["NYS Contractor Registry"]
+        sheet = metadata["NYS Contractor Registry"]
         fields = sheet[sheet["Display?"].astype(str).str.lower().str.contains("x|yes|if data", na=False)]
 
         not_applicable_skip_fields = [
@@ -121,13 +124,9 @@ if st.session_state.selected_business:
 
     # === 2. NYC Contracts ===
     with st.expander("\U0001F4BC NYC Prime & Subcontract Awards"):
-        contracts = data["contracts"]
-        contract_rows = contracts[
-            (contracts["Prime Vendor"].str.contains(selected_name, na=False)) |
-            (contracts["Sub Vendor"].str.contains(selected_name, na=False))
-        ]
+        contract_rows = sources.get("NYC_AWARDS", pd.DataFrame())
         if not contract_rows.empty:
-            sheet = data["metadata"]["NYC Awarded Contracts"]
+            sheet = metadata["NYC Awarded Contracts"]
             fields = sheet[sheet["Display?"].astype(str).str.lower().str.strip() == "x"]["Field"].tolist()
             for _, row in contract_rows.iterrows():
                 st.markdown("---")
@@ -159,43 +158,36 @@ if st.session_state.selected_business:
                 st.write(f"**{label}:** {val}")
                 show_no_violation = False
 
-        theft_df = data["wagetheft"]
         wage_violation_found = False
-        if "company_name" in theft_df.columns:
-            theft_df["company_name_cleaned"] = theft_df["company_name"].str.upper().str.strip()
-            theft_matches = theft_df[theft_df["company_name_cleaned"] == selected_name.upper().strip()]
-            if not theft_matches.empty:
-                wage_violation_found = True
-                for _, row in theft_matches.iterrows():
-                    st.markdown("---")
-                    for col in ["industry", "date", "claimants", "wages_stolen"]:
-                        value = row.get(col, "")
-                        if col == "date":
-                            try:
-                                value = datetime.fromtimestamp(float(value)/1000).strftime("%B %d, %Y")
-                            except:
-                                pass
-                        if pd.notna(value) and value.strip() != "":
-                            st.write(f"**{col.replace('_', ' ').title()}:** {value}")
+        theft_matches = sources.get("WAGE_THEFT", pd.DataFrame())
+        if not theft_matches.empty:
+            wage_violation_found = True
+            for _, row in theft_matches.iterrows():
+                st.markdown("---")
+                for col in ["industry", "date", "claimants", "wages_stolen"]:
+                    value = row.get(col, "")
+                    if col == "date":
+                        try:
+                            value = datetime.fromtimestamp(float(value)/1000).strftime("%B %d, %Y")
+                        except:
+                            pass
+                    if pd.notna(value) and value.strip() != "":
+                        st.write(f"**{col.replace('_', ' ').title()}:** {value}")
 
         if show_no_violation and not wage_violation_found:
             st.success("✅ No known violations on file.")
 
     # === 4. Apprenticeship ===
     with st.expander("\U0001F477 Apprenticeship Program Participation Details"):
-        app_df = data["apprentice"]
-        if "sponsor" in app_df.columns:
-            app_matches = app_df[app_df["sponsor"].str.contains(selected_name, na=False)]
-            if not app_matches.empty:
-                sheet = data["metadata"]["Construction Apprentice"]
-                fields = sheet[sheet["Display?"].astype(str).str.lower().str.strip() == "x"]["Name"].tolist()
-                for _, row in app_matches.iterrows():
-                    st.markdown("---")
-                    for field in fields:
-                        value = row.get(field, "")
-                        if pd.notna(value) and value.strip() != "":
-                            st.write(f"**{field}:** {value}")
-            else:
-                st.write("❌ This contractor is not listed in any apprenticeship program records.")
+        app_matches = sources.get("APPRENTICE", pd.DataFrame())
+        if not app_matches.empty:
+            sheet = metadata["Construction Apprentice"]
+            fields = sheet[sheet["Display?"].astype(str).str.lower().str.strip() == "x"]["Name"].tolist()
+            for _, row in app_matches.iterrows():
+                st.markdown("---")
+                for field in fields:
+                    value = row.get(field, "")
+                    if pd.notna(value) and value.strip() != "":
+                        st.write(f"**{field}:** {value}")
         else:
-            st.error("⚠️ Column 'sponsor' not found in Apprenticeship data.")
+            st.write("❌ This contractor is not listed in any apprenticeship program records.")
@@ -0,0 +1,139 @@
+from collections import defaultdict
+import re
+import numpy as np
+
+ZIP_RE = re.compile(r'^(\d{5})\d*$')
+NUMBER_RE = re.compile(r'^\d+[a-z]?(-\d+[a-z]?)?$')
+ORDINAL_RE = re.compile(r'^(\d+)(st|nd|rd|th)$')
+
+# spelling -> canonical street type
+STREET_TYPES = {
+    'street': 'st', 'st': 'st', 'str': 'st',
+    'avenue': 'ave', 'ave': 'ave', 'av': 'ave',
+    'road': 'rd', 'rd': 'rd',
+    'boulevard': 'blvd', 'blvd': 'blvd',
+    'drive': 'dr', 'dr': 'dr',
+    'lane': 'ln', 'ln': 'ln',
+    'place': 'pl', 'pl': 'pl',
+    'court': 'ct', 'ct': 'ct',
+    'parkway': 'pkwy', 'pkwy': 'pkwy',
+    'highway': 'hwy', 'hwy': 'hwy',
+    'turnpike': 'tpke', 'tpke': 'tpke',
+    'terrace': 'ter', 'ter': 'ter',
+    'circle': 'cir', 'cir': 'cir',
+    'square': 'sq', 'sq': 'sq',
+    'way': 'way', 'plaza': 'plz', 'plz': 'plz',
+}
+DIRECTIONS = {
+    'n': 'n', 'north': 'n', 's': 's', 'south': 's', 'e': 'e', 'east': 'e', 'w': 'w', 'west': 'w',
+    'ne': 'ne', 'nw': 'nw', 'se': 'se', 'sw': 'sw',
+}
+ORDINALS = {
+    'first': '1', 'second': '2', 'third': '3', 'fourth': '4', 'fifth': '5',
+    'sixth': '6', 'seventh': '7', 'eighth': '8', 'ninth': '9', 'tenth': '10',
+}
+UNITS = {'apt', 'suite', 'ste', 'unit', 'fl', 'floor', 'rm', 'room', 'bldg', 'po', 'box'}
+STATES = {
+    'al', 'ak', 'az', 'ar', 'ca', 'co', 'ct', 'de', 'dc', 'fl', 'ga', 'hi', 'id', 'il', 'in', 'ia', 'ks',
+    'ky', 'la', 'me', 'md', 'ma', 'mi', 'mn', 'ms', 'mo', 'mt', 'ne', 'nv', 'nh', 'nj', 'nm', 'ny', 'nc',
+    'nd', 'oh', 'ok', 'or', 'pa', 'ri', 'sc', 'sd', 'tn', 'tx', 'ut', 'vt', 'va', 'wa', 'wv', 'wi', 'wy', 'pr',
+}
+
+def _street_word(t):
+    m = ORDINAL_RE.match(t)
+    return m.group(1) if m else ORDINALS.get(t, t)
+
+def parse_address(s):
+    """(house number, street stem, street type, city, zip) of a normalized address, '' where missing.
+
+    The stem is the street name without directions or type, with ordinals as digits,
+    e.g. '27 n manning blvd albany ny 12206' -> ('27', 'manning', 'blvd', 'albany', '12206').
+    When no street type is found the stem is the first street word and city is left empty.
+    """
+    tokens = [t for t in s.split() if t != 'nan']
+    zipcode = state = number = ''
+    if tokens and ZIP_RE.match(tokens[-1]):
+        zipcode = ZIP_RE.match(tokens.pop()).group(1)
+    if tokens and tokens[-1] in STATES:
+        state = tokens.pop()
+    if tokens and NUMBER_RE.match(tokens[0]):
+        number = tokens.pop(0)
+        # Queens-style numbers written apart, '84 22 grand ave' is 8422 grand ave, but not '10 5 ave'
+        if len(tokens)>1 and tokens[0].isdigit() and tokens[1] not in STREET_TYPES:
+            number += tokens.pop(0)
+
+    end = next((i for i,t in enumerate(tokens) if i>0 and t in STREET_TYPES), None)
+    street = tokens if end is None else tokens[:end]
+    street = [_street_word(t) for t in street if t not in DIRECTIONS] or street
+    if end is None:
+        return number, ' '.join(street[:1]), '', '', zipcode
+
+    rest = tokens[end+1:]
+    while rest and (rest[0] in DIRECTIONS or rest[0] in UNITS or any(c.isdigit() for c in rest[0])):
+        rest = rest[1:]
+    return number, ' '.join(street), STREET_TYPES[tokens[end]], ' '.join(rest), zipcode
+
+def _keys(number, stem, zipcode):
+    keys = []
+    if number and stem:
+        if zipcode:
+            keys.append(('zns', zipcode, number, stem))
+        keys.append(('ns', number, stem))
+    if zipcode and stem:
+        keys.append(('zs', zipcode, stem))
+    return keys
+
+def _street_keys(number, stem, street_type, zipcode):
+    keys = []
+    if stem:
+        keys.append(('s', stem))
+    if zipcode:
+        keys.append(('z', zipcode))
+    if number and street_type:
+        keys.append(('nt', number, street_type))
+    return keys
+
+def address_keys(s):
+    """Index keys of an address, most specific first: ('zns', zip, house number, street stem),
+    ('ns', house number, street stem) and the street-level ('zs', zip, street stem)"""
+    number, stem, _, _, zipcode = parse_address(s)
+    return _keys(number, stem, zipcode)
+
+class AddressIndex:
+    """COMPANY_IDs keyed on parsed (zip, house number, street stem), for address lookups without a scan.
+
+    Street stems (in any zip code), zip codes and (house number, street type) are indexed
+    too, so callers that re-score the candidates with a fuzzy scorer can use street() to
+    also find near-identical house numbers, missing or mistyped zips and mistyped streets.
+    """
+
+    def __init__(self, ids, addresses):
+        index = defaultdict(list)
+        for i,a in zip(ids, addresses):
+            number, stem, street_type, _, zipcode = parse_address(a)
+            for k in _keys(number, stem, zipcode) + _street_keys(number, stem, street_type, zipcode):
+                index[k].append(i)
+        self.index = {k: np.array(v) for k,v in index.items()}
+
+    def _probe(self, keys, kinds):
+        for k in keys:
+            if k[0] in kinds and k in self.index:
+                return self.index[k]
+        return np.array([], dtype=int)
+
+    def lookup(self, address):
+        """COMPANY_IDs at the address, probing the most specific key first; empty if none is indexed"""
+        return self._probe(address_keys(address), ('zns', 'ns'))
+
+    def street(self, address):
+        """COMPANY_IDs on the address's street stem, in its zip code or at its house number on the same
+        type of street, a superset of every other key's rows.
+
+        Empty for an address without a street type, whose stem may just be a city name.
+        """
+        number, stem, street_type, _, zipcode = parse_address(address)
+        if not street_type:
+            return np.array([], dtype=int)
+        keys = _street_keys(number, stem, street_type, zipcode)
+        ids = [self.index[k] for k in keys if k in self.index]
+        return np.unique(np.concatenate(ids)) if ids else np.array([], dtype=int)
@@ -2,13 +2,63 @@ import tkinter as tk
 from tkinter import messagebox, scrolledtext
 import pandas as pd
 import os
-from mapping import CompanyMap, norm_string
-import joblib
+import queue
+import threading
+from mapping import norm_string
+from client import LookupClient
 
 
 
-# Load Data
-mapper = joblib.load("data/out/FinalMap.joblib")
+# Connect to the lookup service (python src/service.py)
+mapper = LookupClient()
+
+SUGGEST_K = 10
+TYPING_DELAY_MS = 150
+POLL_MS = 30
+typing_job = None
+
+
+class LookupWorker(threading.Thread):
+    """Runs lookups off the Tk thread, newest request of each kind first.
+
+    Only the latest submitted request of a kind ("search", "suggest") is kept: one still
+    waiting when a newer one of the same kind arrives is dropped, and the result of one
+    that was already running is discarded. Kinds don't cancel each other, so typing while
+    a search runs still shows its result. Results are handed back through a queue that
+    the Tk thread polls with after().
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.results = queue.Queue()
+        self.generation = {}
+        self.pending = {}
+        self.cond = threading.Condition()
+
+    def submit(self, kind, fn, *args, **kwargs):
+        with self.cond:
+            self.generation[kind] = self.generation.get(kind, 0) + 1
+            # re-insert so kinds run in the order they were last submitted
+            self.pending.pop(kind, None)
+            self.pending[kind] = (self.generation[kind], fn, args, kwargs)
+            self.cond.notify()
+
+    def stale(self, kind, generation):
+        return generation != self.generation[kind]
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                kind = next(iter(self.pending))
+                generation, fn, args, kwargs = self.pending.pop(kind)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                result = e
+            if not self.stale(kind, generation):
+                self.results.put((kind, args, kwargs, result))
 
 
 # Business Search Function
@@ -19,9 +69,17 @@ def search_business():
         messagebox.showerror("Error", "Please enter a Business Name!")
         return
 
-    # get matches
-    matches = mapper.get_matches(names=[search_name], address=search_addr)
+    # get matches on the worker, show_matches runs when they arrive
+    global typing_job
+    if typing_job is not None:
+        root.after_cancel(typing_job)
+        typing_job = None
+    status.set(f"Searching for '{search_name}'...")
+    worker.submit("search", mapper.get_matches, names=[search_name], address=search_addr)
+
 
+def show_matches(search_name, matches):
+    status.set("")
     if len(matches)==0:
         messagebox.showinfo("No Match", f"No business found for '{search_name}'.")
         return
@@ -65,9 +123,62 @@ def search_business():
     profile_output.delete(1.0, tk.END)
     if len(matches)>0:
         for m,d in matches.items():
-            cols = mapper.mappers[m].name_cols + [mapper.mappers[m].addr_col]
+            cols = mapper.name_cols + [mapper.addr_col]
             profile_output.insert(tk.END, f"{m}\n{d[cols]}\n\n")
 
+
+# Typeahead: suggest top-k names while typing, once typing pauses
+def on_name_key(event):
+    global typing_job
+    if event.keysym in ("Return", "Up", "Down"):
+        return
+    if typing_job is not None:
+        root.after_cancel(typing_job)
+    typing_job = root.after(TYPING_DELAY_MS, suggest_names)
+
+
+def suggest_names():
+    global typing_job
+    typing_job = None
+    text = norm_string(entry_name.get())
+    if not text:
+        suggestions.delete(0, tk.END)
+        return
+    worker.submit("suggest", mapper.suggest, text, SUGGEST_K)
+
+
+def show_suggestions(hits):
+    suggestions.delete(0, tk.END)
+    for _, name, score in hits:
+        suggestions.insert(tk.END, f"{name}  ({score:.0f})")
+    suggestion_names[:] = [name for _, name, _ in hits]
+
+
+def pick_suggestion(event):
+    selected = suggestions.curselection()
+    if not selected:
+        return
+    entry_name.delete(0, tk.END)
+    entry_name.insert(0, suggestion_names[selected[0]])
+    suggestions.delete(0, tk.END)
+    search_business()
+
+
+def poll_results():
+    while True:
+        try:
+            kind, args, kwargs, result = worker.results.get_nowait()
+        except queue.Empty:
+            break
+        if isinstance(result, Exception):
+            status.set("")
+            messagebox.showerror("Error", f"Lookup failed: {result}")
+        elif kind == "suggest":
+            show_suggestions(result)
+        else:
+            show_matches(kwargs["names"][0], result)
+    root.after(POLL_MS, poll_results)
+
 # GUI Setup
 root = tk.Tk()
 root.title("Contractor Profile Lookup")
@@ -77,15 +188,27 @@ root.geometry("750x700")
 tk.Label(root, text="Enter Business Name:", font=("Arial", 12)).pack(pady=5)
 entry_name = tk.Entry(root, font=("Arial", 12), width=40)
 entry_name.pack(pady=5)
+entry_name.bind("<KeyRelease>", on_name_key)
+entry_name.bind("<Return>", lambda event: search_business())
+suggestions = tk.Listbox(root, font=("Arial", 10), width=60, height=6)
+suggestions.pack(pady=2)
+suggestions.bind("<<ListboxSelect>>", pick_suggestion)
+suggestion_names = []
 entry_addr = tk.Entry(root, font=("Arial", 12), width=40)
 entry_addr.pack(pady=5)
 
 # Search Button
 tk.Button(root, text="Search", font=("Arial", 12), command=search_business).pack(pady=10)
 
+status = tk.StringVar()
+tk.Label(root, textvariable=status, font=("Arial", 10)).pack()
+
 # Profile Output (Scrollable)
 profile_output = scrolledtext.ScrolledText(root, width=80, height=25, font=("Arial", 10))
 profile_output.pack(pady=10, padx=10)
 
 # Run the App
+worker = LookupWorker()
+worker.start()
+root.after(POLL_MS, poll_results)
 root.mainloop()
@@ -0,0 +1,207 @@
+from mapping import FuzzyMatch
+import argparse
+from datetime import datetime
+import json
+import multiprocessing as mp
+import platform
+import resource
+import time
+import numpy as np
+import pandas as pd
+
+WORDS = [
+    'atlas', 'empire', 'hudson', 'liberty', 'metro', 'summit', 'pioneer', 'keystone', 'harbor', 'granite',
+    'eagle', 'union', 'capital', 'north', 'island', 'bay', 'ridge', 'park', 'river', 'crown', 'apex', 'delta',
+    'titan', 'unity', 'vista', 'legacy', 'premier', 'quality', 'allied', 'national', 'royal', 'star', 'sun',
+    'borough', 'county', 'queens', 'bronx', 'kings', 'richmond', 'albany', 'buffalo', 'hamilton', 'lincoln',
+]
+SURNAMES = [
+    'smith', 'johnson', 'williams', 'brown', 'jones', 'garcia', 'miller', 'davis', 'rodriguez', 'martinez',
+    'lopez', 'gonzalez', 'wilson', 'anderson', 'thomas', 'taylor', 'moore', 'jackson', 'martin', 'lee',
+    'perez', 'thompson', 'white', 'harris', 'sanchez', 'clark', 'ramirez', 'lewis', 'robinson', 'walker',
+    'rossi', 'russo', 'esposito', 'kowalski', 'nowak', 'chen', 'wang', 'kim', 'park', 'nguyen', 'singh',
+]
+TRADES = [
+    'construction', 'contracting', 'builders', 'electric', 'plumbing', 'roofing', 'masonry', 'concrete',
+    'painting', 'restoration', 'mechanical', 'demolition', 'carpentry', 'excavation', 'paving', 'steel',
+    'glass', 'scaffolding', 'hvac', 'drywall', 'flooring', 'landscaping', 'general contractors', 'development',
+]
+SUFFIXES = ['inc', 'llc', 'corp', 'co', 'corporation', 'incorporated', 'ltd', '']
+STREETS = ['main', 'broadway', 'park', 'oak', 'maple', 'elm', 'washington', 'church', 'river', 'lake', 'hill', 'central', 'grand', 'jackson', 'atlantic']
+STREET_TYPES = [('street', 'st'), ('avenue', 'ave'), ('road', 'rd'), ('boulevard', 'blvd'), ('drive', 'dr'), ('place', 'pl')]
+CITIES = [
+    ('brooklyn', '112'), ('bronx', '104'), ('new york', '100'), ('staten island', '103'), ('long island city', '111'),
+    ('yonkers', '107'), ('albany', '122'), ('buffalo', '142'), ('rochester', '146'), ('syracuse', '132'),
+]
+
+def _typo(rng, s):
+    """Drop, duplicate, swap or replace one character"""
+    if len(s) < 4:
+        return s
+    i = rng.integers(1, len(s)-1)
+    kind = rng.integers(4)
+    if kind == 0:
+        return s[:i] + s[i+1:]
+    if kind == 1:
+        return s[:i] + s[i] + s[i:]
+    if kind == 2:
+        return s[:i-1] + s[i] + s[i-1] + s[i+1:]
+    return s[:i] + chr(rng.integers(97, 123)) + s[i+1:]
+
+def _entity(rng):
+    stem = rng.choice(SURNAMES) if rng.random() < 0.5 else ' '.join(rng.choice(WORDS, rng.integers(1, 3), replace=False))
+    name = f'{stem} {rng.choice(TRADES)}'
+    dba = f'{rng.choice(WORDS)} {rng.choice(TRADES)}' if rng.random() < 0.3 else ''
+    city, zip3 = CITIES[rng.integers(len(CITIES))]
+    street_type = STREET_TYPES[rng.integers(len(STREET_TYPES))]
+    return {
+        'name': name,
+        'suffix': rng.choice(SUFFIXES),
+        'dba': dba,
+        'number': str(rng.integers(1, 9999)),
+        'street': rng.choice(STREETS),
+        'street_type': street_type,
+        'city': city,
+        'zip': zip3 + f'{rng.integers(100):02d}',
+    }
+
+def _record(rng, e):
+    """One source record of entity e with realistic perturbations"""
+    suffix = e['suffix'] if rng.random() < 0.6 else rng.choice(SUFFIXES)
+    name1 = f"{e['name']} {suffix}".strip().upper()
+    name2 = e['dba'].upper()
+    if rng.random() < 0.15:
+        name1 = _typo(rng, name1)
+    if name2 and rng.random() < 0.2:
+        name1, name2 = name2, name1
+    if rng.random() < 0.2:
+        name1 = name1.replace(' AND ', ' & ')
+
+    if rng.random() < 0.2:
+        address = ''
+    else:
+        street_type = e['street_type'][int(rng.random() < 0.5)]
+        address = f"{e['number']} {e['street']} {street_type} {e['city']} ny {e['zip']}".upper()
+        if rng.random() < 0.1:
+            address = _typo(rng, address)
+    return name1, name2, address
+
+def generate(n, seed=0, n_sources=6, dup_rate=0.5):
+    """Synthetic df_dict of about n records over n_sources sources, with a TRUE_ID entity label per record"""
+    rng = np.random.default_rng(seed)
+    n_entities = int(n / (1 + dup_rate))
+    entities = [_entity(rng) for _ in range(n_entities)]
+    true_ids = np.concatenate([np.arange(n_entities), rng.integers(0, n_entities, n - n_entities)])
+    sources = rng.integers(0, n_sources, n)
+    rows = [(f'SOURCE_{s}', t) + _record(rng, entities[t]) for s,t in zip(sources, true_ids)]
+    df = pd.DataFrame(rows, columns=['SOURCE','TRUE_ID','NAME1','NAME2','ADDRESS'])
+    return {k: v.drop(columns='SOURCE').reset_index(drop=True) for k,v in df.groupby('SOURCE')}
+
+def _pairs(a, b):
+    a, b = np.minimum(a, b), np.maximum(a, b)
+    keep = a != b
+    return set(zip(a[keep].tolist(), b[keep].tolist()))
+
+def evaluate(match_df, df_dict):
+    """Pairwise precision and recall of match_df against the generator's TRUE_IDs"""
+    records = pd.concat(df_dict.values())[['TRUE_ID','COMPANY_ID']].drop_duplicates()
+    truth = records.merge(records, on='TRUE_ID')
+    true_pairs = _pairs(truth['COMPANY_ID_x'].values, truth['COMPANY_ID_y'].values)
+    found = _pairs(match_df['COMPANY_ID'].values, match_df['COMPANY_MATCH'].values)
+    hits = len(true_pairs & found)
+    return {
+        'precision': hits / len(found) if found else float('nan'),
+        'recall': hits / len(true_pairs) if true_pairs else float('nan'),
+        'true_pairs': len(true_pairs),
+        'found_pairs': len(found),
+    }
+
+def _pairs_scored(match):
+    """Candidate pairs the matcher scores for its current name_df"""
+    if match.engine=='tfidf':
+        return match.profiler.counters.get('pairs_scored', 0)
+    if match.blocks is None:
+        return len(match.name_df)**2
+    cols = [match.name_df[c] for c in match.name_cols]
+    return int(sum(
+        len(np.union1d(match._candidates(r[1:-1], r[-1]), [r[0]]))
+        for r in zip(match.name_df['COMPANY_ID'], *cols, match.name_df[match.addr_col])
+    ))
+
+# preset FuzzyMatch settings compared by the suite
+CONFIGS = {
+    'apply': {},
+    'apply+block': {'block_size': 100},
+    'cdist': {'engine': 'cdist', 'workers': -1},
+    'cdist+block': {'engine': 'cdist', 'workers': -1, 'block_size': 100},
+    'tfidf': {'engine': 'tfidf', 'workers': -1},
+    'tfidf+cosine': {'engine': 'tfidf', 'workers': -1, 'rescore': False},
+}
+
+def run_one(n, config, seed):
+    """Generate, match and score one (size, config) case; meant to run in a fresh process"""
+    df_dict = generate(n, seed)
+    match = FuzzyMatch(['NAME1','NAME2'], 'ADDRESS', **CONFIGS[config])
+    t0, c0 = time.perf_counter(), time.process_time()
+    match_df, df_dict = match.index_and_match(df_dict)
+    wall, cpu = time.perf_counter()-t0, time.process_time()-c0
+    pairs = _pairs_scored(match)
+    result = {
+        'rows': n,
+        'config': config,
+        'seed': seed,
+        'name_rows': len(match.name_df),
+        'wall_s': wall,
+        'cpu_s': cpu,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'pairs_scored': pairs,
+        'pairs_per_s': pairs / wall,
+        'edges': len(match_df),
+    }
+    result.update(evaluate(match_df, df_dict))
+    return result
+
+def compare(results, baseline):
+    """Print wall time, peak memory and quality against a saved baseline run"""
+    base = {(r['rows'], r['config']): r for r in baseline['results']}
+    for r in results['results']:
+        b = base.get((r['rows'], r['config']))
+        if b is None:
+            continue
+        print(
+            f"{r['config']:>12} {r['rows']:>8}: "
+            f"wall x{r['wall_s']/b['wall_s']:.2f}, rss x{r['peak_rss_mb']/b['peak_rss_mb']:.2f}, "
+            f"precision {b['precision']:.3f} -> {r['precision']:.3f}, recall {b['recall']:.3f} -> {r['recall']:.3f}"
+        )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Synthetic-scale benchmark of the matching pipeline')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--configs', nargs='+', choices=list(CONFIGS), default=['cdist+block'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=f"data/out/benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument('--baseline', help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    results = {
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': [],
+    }
+    # a fresh process per case keeps peak RSS from leaking between cases
+    ctx = mp.get_context('spawn')
+    for n in args.sizes:
+        for config in args.configs:
+            with ctx.Pool(1) as pool:
+                r = pool.apply(run_one, (n, config, args.seed))
+            print(json.dumps(r))
+            results['results'].append(r)
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Saved {args.out}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
@@ -1,53 +1,396 @@
-from mapping import FuzzyMatch
-import pandas as pd
-from fuzzywuzzy import fuzz
-import sqlite3 as sql
-
-reg = pd.read_csv("data/processed/cleaned_contractors.csv") 
-reg['Address 2'] = reg['Address 2'].str.replace('NOT APPLICABLE', '')
-reg['ADDRESS'] = reg['Address'].fillna("") + " " + reg['Address 2'].fillna("") + " " + reg['City'].fillna("") + " " + reg['State'].fillna("") + " " + reg['Zip Code'].fillna("")
-reg.rename(columns={'Business Name':'NAME1','DBA Name':'NAME2'}, inplace=True)
-
-debar = pd.read_csv('data/processed/NYSDOL_debarment_02_19_2025.csv')
-debar.rename(columns={'EMPLOYER_NAME':'NAME1','EMPLOYER_DBA':'NAME2'}, inplace=True)
-
-sig = pd.read_csv('data/processed/cleaned_apprentice.csv')
-sig['ADDRESS'] = sig['signatory_address'].fillna("") + " " + sig['city'].fillna("") + " " + sig['state'].fillna("") + " " + sig['zip_code'].fillna("")
-sig.rename(columns={'signatory_name':'NAME1'}, inplace=True)
-
-nyc = pd.read_csv('data/processed/Cleaned_NYC_Awarded_Contracts.csv')
-prime_cols = [c for c in nyc.columns if 'prime' in c.lower()]
-sub_cols = [c for c in nyc.columns if 'sub' in c.lower()]
-nyc.loc[nyc['Vendor Record Type']=='Prime Vendor','NAME1'] = nyc.loc[nyc['Vendor Record Type']=='Prime Vendor','Prime Vendor']
-nyc.loc[nyc['Vendor Record Type']=='Sub Vendor','NAME1'] = nyc.loc[nyc['Vendor Record Type']=='Sub Vendor','Sub Vendor']
-nyc = nyc.fillna('').drop_duplicates()
-nyc['ADDRESS'] = ''
-
-theft = pd.read_csv('data/processed/cleaned_construction_nywagetheft.csv')
-theft['ADDRESS'] = theft['city'].fillna("") + " " + theft['zip_code'].fillna("")
-theft.rename(columns={'company_name':'NAME1'}, inplace=True)
-
-usdol = pd.read_csv('data/processed/usdol_wage_construction.csv')
-usdol['ADDRESS'] = usdol['street_addr_1_txt'].fillna("") + " " + usdol['cty_nm'].fillna("") + " " + usdol['st_cd'].fillna("") + " " + usdol['zip_cd'].astype(str).fillna("")
-
-df_dict = {
-    'REGISTRY': reg, 
-    'DEBARMENT': debar,
-    'APPRENTICE': sig,
-    'NYC_AWARDS': nyc,
-    'WAGE_THEFT': theft,
-    'USDOL': usdol} 
-match = FuzzyMatch(['NAME1','NAME2'], 'ADDRESS', threshold=95, avg_threshold=80, fuzzy_alg=fuzz.ratio)
-match_df, df_dict = match.index_and_match(df_dict)
-
-conn = sql.connect('data/out/nyffc.db')
-cur = conn.cursor()
-
-match_df.to_sql('match', conn, if_exists='replace', index=False)
-match.name_df.to_sql('name', conn, if_exists='replace', index=False)
-
-for k,v in df_dict.items():
-    v.to_sql(k, conn, if_exists='replace', index=False)
-    conn.commit()
-
-conn.close()
+from db import connect, insert_rows, transaction, write_table
+from entity import entity_members, resolve_entities
+from intervals import DATE_COLS, INTERVALS, date_intervals, normalize_dates, write_intervals
+from mapping import FuzzyMatch, mean_score
+from match_graph import MatchGraph
+from match_index import MatchIndex
+from pair_scores import PairScores
+from processed import fingerprint, read_processed
+from profiles import entity_profiles
+from profiling import Profiler
+import pandas as pd
+from fuzzywuzzy import fuzz
+import argparse
+import cProfile
+from datetime import datetime
+from glob import glob
+import numpy as np
+import os
+import re
+
+DB_PATH = 'data/out/nyffc.db'
+INDEX_PATH = 'data/out/match_index.bin'
+GRAPH_PATH = 'data/out/match_graph.bin'
+PAIRS_PATH = 'data/out/pair_scores.bin'
+
+# matching thresholds of a first or full build, recorded in the params table
+DEFAULT_PARAMS = {'threshold': 95, 'avg_threshold': 80, 'score_floor': 70}
+
+def latest_debarment():
+    """Most recent NYSDOL_debarment_<MM_DD_YYYY>.csv snapshot"""
+    paths = glob('data/processed/NYSDOL_debarment_*.csv')
+    return max(paths, key=lambda p: datetime.strptime(re.search(r'(\d{2}_\d{2}_\d{4})', p).group(1), '%m_%d_%Y'))
+
+def load_registry(path):
+    reg = read_processed(path)
+    reg['Address 2'] = reg['Address 2'].str.replace('NOT APPLICABLE', '')
+    reg['ADDRESS'] = reg['Address'].fillna("") + " " + reg['Address 2'].fillna("") + " " + reg['City'].fillna("") + " " + reg['State'].fillna("") + " " + reg['Zip Code'].fillna("")
+    reg.rename(columns={'Business Name':'NAME1','DBA Name':'NAME2'}, inplace=True)
+    return reg
+
+def load_debarment(path):
+    debar = read_processed(path)
+    debar.rename(columns={'EMPLOYER_NAME':'NAME1','EMPLOYER_DBA':'NAME2'}, inplace=True)
+    return debar
+
+def load_apprentice(path):
+    sig = read_processed(path)
+    sig['ADDRESS'] = sig['signatory_address'].fillna("") + " " + sig['city'].fillna("") + " " + sig['state'].fillna("") + " " + sig['zip_code'].fillna("")
+    sig.rename(columns={'signatory_name':'NAME1'}, inplace=True)
+    return sig
+
+def load_nyc_awards(path):
+    nyc = read_processed(path)
+    nyc.loc[nyc['Vendor Record Type']=='Prime Vendor','NAME1'] = nyc.loc[nyc['Vendor Record Type']=='Prime Vendor','Prime Vendor']
+    nyc.loc[nyc['Vendor Record Type']=='Sub Vendor','NAME1'] = nyc.loc[nyc['Vendor Record Type']=='Sub Vendor','Sub Vendor']
+    nyc['NAME1'] = nyc['NAME1'].fillna('')
+    prime = nyc['Vendor Record Type']=='Prime Vendor'
+    nyc['CONTRACT_START'] = nyc['Prime Contract Start Date'].where(prime, nyc['Sub Contract Start Date'])
+    nyc['CONTRACT_END'] = nyc['Prime Contract End Date'].where(prime, nyc['Sub Contract End Date'])
+    nyc = nyc.drop_duplicates()
+    nyc['ADDRESS'] = ''
+    return nyc
+
+def load_wage_theft(path):
+    theft = read_processed(path)
+    theft['ADDRESS'] = theft['city'].fillna("") + " " + theft['zip_code'].fillna("")
+    theft.rename(columns={'company_name':'NAME1'}, inplace=True)
+    return theft
+
+def load_usdol(path):
+    usdol = read_processed(path)
+    usdol['ADDRESS'] = usdol['street_addr_1_txt'].fillna("") + " " + usdol['cty_nm'].fillna("") + " " + usdol['st_cd'].fillna("") + " " + usdol['zip_cd'].astype(str).fillna("")
+    return usdol
+
+# source name -> (processed input, loader)
+SOURCES = {
+    'REGISTRY': ('data/processed/cleaned_contractors.csv', load_registry),
+    'DEBARMENT': (latest_debarment(), load_debarment),
+    'APPRENTICE': ('data/processed/cleaned_apprentice_droppedcolumn.xlsx', load_apprentice),
+    'NYC_AWARDS': ('data/processed/Cleaned_NYC_Awarded_Contracts.csv', load_nyc_awards),
+    'WAGE_THEFT': ('data/processed/cleaned_construction_nywagetheft.csv', load_wage_theft),
+    'USDOL': ('data/processed/usdol_wage_construction.csv', load_usdol),
+}
+
+# table -> (primary key, indexed columns), per-source tables use SOURCE_SCHEMA
+SCHEMA = {
+    'match': ('MATCH_ID', ['COMPANY_ID','COMPANY_MATCH']),
+    'name': ('COMPANY_ID', []),
+    'entity': ('COMPANY_ID', ['ENTITY_ID']),
+    'entity_members': ('ENTITY_ID', []),
+    'entity_profile': ('ENTITY_ID', []),
+    'source': ('SOURCE', []),
+    'params': (None, []),
+}
+SOURCE_SCHEMA = (None, ['COMPANY_ID'])
+
+def source_df():
+    return pd.DataFrame(
+        [(k, path, fingerprint(path)) for k,(path,_) in SOURCES.items()],
+        columns=['SOURCE','PATH','FINGERPRINT'],
+    )
+
+def has_table(conn, table):
+    return conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+def stored_sources(conn):
+    """Fingerprints recorded by the last build, empty if there was none"""
+    if not has_table(conn, 'source'):
+        return pd.DataFrame(columns=['SOURCE','PATH','FINGERPRINT'])
+    return pd.read_sql('SELECT * FROM source', conn)
+
+def match_params(match, score_floor=None):
+    """Thresholds of a FuzzyMatch, keyed like DEFAULT_PARAMS"""
+    return {
+        'threshold': match.threshold,
+        'avg_threshold': match.avg_threshold,
+        'score_floor': match.score_floor if score_floor is None else score_floor,
+    }
+
+def params_df(params):
+    return pd.DataFrame([{k.upper(): v for k,v in params.items()}])
+
+def stored_params(conn):
+    """Thresholds the match table was built with, empty if they were not recorded"""
+    if not has_table(conn, 'params'):
+        return {}
+    row = conn.execute(f'SELECT {", ".join(k.upper() for k in DEFAULT_PARAMS)} FROM params').fetchone()
+    return {} if row is None else dict(zip(DEFAULT_PARAMS, row))
+
+def check_params(conn, match):
+    """Refuse to extend a match table built with other thresholds than match's"""
+    stored = stored_params(conn)
+    params = match_params(match)
+    if any(stored[k] != params[k] for k in stored):
+        raise ValueError(
+            f'{DB_PATH} was matched with {stored}, not {params}; '
+            'update with its thresholds, change them with --rethreshold or rebuild'
+        )
+
+def write_index(conn, match):
+    """Write the memory-mapped lookup index from the finished database"""
+    name_df = pd.read_sql('SELECT * FROM name ORDER BY COMPANY_ID', conn)
+    source_ids = {
+        k: pd.read_sql(f'SELECT COMPANY_ID FROM "{k}" ORDER BY rowid', conn)['COMPANY_ID'].values
+        for k in SOURCES
+    }
+    MatchIndex.write(INDEX_PATH, name_df, source_ids, match)
+
+def write_graph(match, match_df, pairs=None):
+    """Save the CSR match graph of the match edges next to the database, with their scores.
+
+    Scores come from the pair scores the match kept where there are some, and edges they
+    don't cover (no score floor, or one above the thresholds) are scored again.
+    """
+    a = match_df['COMPANY_ID'].values
+    b = match_df['COMPANY_MATCH'].values
+    if pairs is None:
+        namescore, addrscore = match._score_pairs(a, b)
+    else:
+        namescore, addrscore = pairs.lookup(a, b)
+        missing = np.isnan(namescore) & np.isnan(addrscore)
+        if missing.any():
+            namescore[missing], addrscore[missing] = match._score_pairs(a[missing], b[missing])
+    graph = MatchGraph.from_edges(len(match.name_df), a, b, mean_score(namescore, addrscore))
+    graph.save(GRAPH_PATH)
+    return graph
+
+def write_pair_scores(match, old_nodes=None, stale=()):
+    """Save the pair scores kept by the last match, appended to the stored ones after an update
+    without those of the stale COMPANY_IDs.
+
+    An update can only extend pair scores of the same floor over the rows it started from;
+    otherwise the stale file is removed, and rethreshold needs a full build first.
+    Returns the saved PairScores, or None.
+    """
+    if match.pairs is None:
+        return None
+    nodes = len(match.name_df)
+    if old_nodes is None:
+        pairs = PairScores.from_chunks(match.pairs, match.score_floor, nodes, match.score_dtype)
+    else:
+        old = PairScores.open(PAIRS_PATH) if os.path.exists(PAIRS_PATH) else None
+        if old is None or old.floor != match.score_floor or old.nodes != old_nodes:
+            print(f'{PAIRS_PATH} does not cover the previous build, removing it')
+            if old is not None:
+                os.remove(PAIRS_PATH)
+            return None
+        pairs = old.drop(stale).extend(match.pairs, nodes)
+    pairs.save(PAIRS_PATH)
+    match.profiler.count('pairs_kept', len(pairs))
+    return pairs
+
+def referenced_ids(conn):
+    """COMPANY_IDs of the rows of the source tables written so far"""
+    query = ' UNION '.join(f'SELECT COMPANY_ID FROM "{k}"' for k in SOURCES)
+    return pd.read_sql(query, conn)['COMPANY_ID'].values
+
+def write_entities(conn, match, graph, max_size=None):
+    """Cluster the match graph into entities and store COMPANY_ID -> ENTITY_ID and member lists.
+
+    Name rows no source references any more, left behind by updates, get no entity.
+    """
+    with match.profiler.stage('resolve'):
+        entity = resolve_entities(match, graph, max_size=max_size)
+    entity = entity[entity['COMPANY_ID'].isin(referenced_ids(conn))]
+    members = entity_members(entity)
+    write(conn, 'entity', entity)
+    write(conn, 'entity_members', members)
+    match.profiler.count('entities', len(members))
+    with match.profiler.stage('profiles'):
+        write_profiles(conn, entity, members)
+
+def write_profiles(conn, entity, members):
+    """Materialize one profile row per entity from the name and source tables written so far"""
+    name_df = pd.read_sql('SELECT * FROM name', conn)
+    sources = {k: pd.read_sql(f'SELECT * FROM "{k}"', conn) for k in SOURCES}
+    write(conn, 'entity_profile', entity_profiles(entity, members, name_df, sources))
+
+def write_date_intervals(conn):
+    """Rebuild the date interval index from the source tables written so far"""
+    sources = {k: pd.read_sql(f'SELECT rowid AS SOURCE_ROWID, * FROM "{k}"', conn) for k in INTERVALS if k in SOURCES}
+    intervals = date_intervals(sources)
+    write_intervals(conn, intervals)
+    return intervals
+
+def write(conn, table, df):
+    """Replace a table using its declared primary key and indexes"""
+    primary_key, indexes = SCHEMA.get(table, SOURCE_SCHEMA)
+    write_table(conn, table, df, primary_key=primary_key, indexes=indexes)
+
+def load(profiler, sources):
+    """Run the loader of each source, timing each and counting its rows"""
+    df_dict = {}
+    for k in sources:
+        path, loader = SOURCES[k]
+        with profiler.stage(f'load/{k}'):
+            df_dict[k] = normalize_dates(loader(path), DATE_COLS.get(k, []))
+        profiler.count(f'rows/{k}', len(df_dict[k]))
+    return df_dict
+
+def build(conn, match, max_entity_size=None):
+    """Rebuild every table from scratch"""
+    profiler = match.profiler
+    with profiler.stage('fingerprint'):
+        sources = source_df()
+    df_dict = load(profiler, SOURCES)
+    match_df, df_dict = match.index_and_match(df_dict)
+    with profiler.stage('pair_scores'):
+        pairs = write_pair_scores(match)
+    with profiler.stage('graph'):
+        graph = write_graph(match, match_df, pairs)
+
+    with profiler.stage('to_sql'), transaction(conn):
+        write(conn, 'match', match_df)
+        write(conn, 'name', match.name_df)
+        for k,v in df_dict.items():
+            write(conn, k, v)
+        write(conn, 'source', sources)
+        write(conn, 'params', params_df(match_params(match)))
+        with profiler.stage('intervals'):
+            profiler.count('intervals', len(write_date_intervals(conn)))
+        with profiler.stage('entities'):
+            write_entities(conn, match, graph, max_entity_size)
+    with profiler.stage('analyze'):
+        conn.execute('ANALYZE')
+    with profiler.stage('index'):
+        write_index(conn, match)
+
+def update(conn, match, max_entity_size=None):
+    """Reload only sources whose fingerprint changed and match their new name/address rows.
+
+    The new rows are matched with match's thresholds, which must be those the database was built with.
+    """
+    profiler = match.profiler
+    with profiler.stage('fingerprint'):
+        sources = source_df()
+    old = stored_sources(conn)
+    if len(old)==0:
+        return build(conn, match, max_entity_size)
+    check_params(conn, match)
+
+    changed = sources.merge(old, how='left', on=['SOURCE','PATH','FINGERPRINT'], indicator=True)
+    changed = list(changed.loc[changed['_merge']=='left_only', 'SOURCE'])
+    if len(changed)==0:
+        print('All sources unchanged')
+        return
+    print(f"Updating {', '.join(changed)}")
+
+    with profiler.stage('read_db'):
+        name_df = pd.read_sql('SELECT * FROM name ORDER BY COMPANY_ID', conn)
+        match_df = pd.read_sql('SELECT * FROM match ORDER BY MATCH_ID', conn)
+        old_ids = referenced_ids(conn)
+        kept_ids = np.concatenate([np.array([], dtype=int)] + [
+            pd.read_sql(f'SELECT COMPANY_ID FROM "{k}"', conn)['COMPANY_ID'].values for k in SOURCES if k not in changed
+        ])
+    df_dict = load(profiler, changed)
+    new_match, new_names, df_dict, stale = match.update_and_match(df_dict, name_df, match_df, old_ids, kept_ids)
+    match_df = match_df[~(match_df['COMPANY_ID'].isin(stale) | match_df['COMPANY_MATCH'].isin(stale))]
+    match_df = pd.concat([match_df, new_match], ignore_index=True)
+    with profiler.stage('pair_scores'):
+        pairs = write_pair_scores(match, len(name_df), stale)
+    with profiler.stage('graph'):
+        graph = write_graph(match, match_df, pairs)
+
+    with profiler.stage('to_sql'), transaction(conn):
+        if len(stale)>0:
+            write(conn, 'match', match_df)
+        else:
+            insert_rows(conn, 'match', new_match)
+        insert_rows(conn, 'name', new_names)
+        for k,v in df_dict.items():
+            write(conn, k, v)
+        write(conn, 'source', sources)
+        write(conn, 'params', params_df(match_params(match)))
+        with profiler.stage('intervals'):
+            profiler.count('intervals', len(write_date_intervals(conn)))
+        with profiler.stage('entities'):
+            write_entities(conn, match, graph, max_entity_size)
+    with profiler.stage('analyze'):
+        conn.execute('ANALYZE')
+    with profiler.stage('index'):
+        write_index(conn, match)
+
+def rethreshold(conn, match, max_entity_size=None):
+    """Regenerate the match table, graph, entities and index for match's thresholds from the stored
+    pair scores, without matching again. The score floor stays that of the stored pair scores."""
+    profiler = match.profiler
+    with profiler.stage('read_db'):
+        match.name_df = pd.read_sql('SELECT * FROM name ORDER BY COMPANY_ID', conn)
+    pairs = PairScores.open(PAIRS_PATH)
+    if pairs.nodes != len(match.name_df):
+        raise ValueError(f'{PAIRS_PATH} does not belong to {DB_PATH}, rebuild it')
+    if match.score_floor is not None and match.score_floor != pairs.floor:
+        raise ValueError(f'{PAIRS_PATH} was kept down to {pairs.floor}, rebuild it for another score floor')
+    with profiler.stage('filter'):
+        keep = pairs.keep(match.threshold, match.avg_threshold)
+        match_df = pairs.match_df(match.threshold, match.avg_threshold)
+    profiler.count('edges', len(match_df))
+    with profiler.stage('graph'):
+        graph = MatchGraph.from_edges(len(match.name_df), match_df['COMPANY_ID'], match_df['COMPANY_MATCH'], pairs.edge_scores(keep))
+        graph.save(GRAPH_PATH)
+
+    with profiler.stage('to_sql'), transaction(conn):
+        write(conn, 'match', match_df)
+        write(conn, 'params', params_df(match_params(match, pairs.floor)))
+        with profiler.stage('entities'):
+            write_entities(conn, match, graph, max_entity_size)
+    with profiler.stage('analyze'):
+        conn.execute('ANALYZE')
+    with profiler.stage('index'):
+        write_index(conn, match)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the nyffc sqlite database')
+    parser.add_argument('--incremental', action='store_true', help='only reload and match sources that changed since the last build')
+    parser.add_argument('--rethreshold', action='store_true', help='only regenerate the match table and what follows from it for new thresholds, from the stored pair scores')
+    parser.add_argument('--threshold', type=float, help='minimum name or address score of a match (default 95)')
+    parser.add_argument('--avg-threshold', type=float, help='minimum mean of the name and address scores of a match (default 80)')
+    parser.add_argument('--score-floor', type=float, help='keep the scores of candidate pairs passing this as both thresholds, for --rethreshold and pair_scores.py (default 70)')
+    parser.add_argument('--processes', type=int, default=1, help='match shards of name rows on this many processes, -1 for one per core')
+    parser.add_argument('--chunk-size', type=int, default=2048, help='name rows per shard with --processes')
+    parser.add_argument('--max-entity-size', type=int, default=50, help='split entities larger than this by match score')
+    parser.add_argument('--profile-out', default='data/out/build_profile.json', help='JSON report of stage timings, memory and counters')
+    parser.add_argument('--cprofile', help='also write a cProfile dump here (view with snakeviz or pstats)')
+    args = parser.parse_args()
+
+    conn = connect(DB_PATH)
+    # --incremental and --rethreshold keep the stored thresholds that are not given
+    stored = stored_params(conn) if args.incremental or args.rethreshold else {}
+    params = {k: stored.get(k, v) if getattr(args, k) is None else getattr(args, k) for k,v in DEFAULT_PARAMS.items()}
+    print(f'Thresholds {params}')
+
+    profiler = Profiler()
+    match = FuzzyMatch(
+        ['NAME1','NAME2'], 'ADDRESS', threshold=params['threshold'], avg_threshold=params['avg_threshold'], fuzzy_alg=fuzz.ratio,
+        block_size=100, engine='cdist', profiler=profiler, score_floor=params['score_floor'],
+        # one scoring thread per process when matching on a pool
+        workers=-1 if args.processes==1 else 1, processes=args.processes, chunk_size=args.chunk_size,
+    )
+
+    cprof = cProfile.Profile() if args.cprofile else None
+    if cprof is not None:
+        cprof.enable()
+    if args.rethreshold:
+        rethreshold(conn, match, args.max_entity_size)
+    elif args.incremental:
+        update(conn, match, args.max_entity_size)
+    else:
+        build(conn, match, args.max_entity_size)
+    conn.close()
+    if cprof is not None:
+        cprof.disable()
+        cprof.dump_stats(args.cprofile)
+
+    profiler.save(args.profile_out)
+    print(f'Saved {args.profile_out}')
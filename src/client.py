@@ -0,0 +1,54 @@
+import json
+import pandas as pd
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+SERVICE_URL = 'http://127.0.0.1:8765'
+
+class LookupClient:
+    """Thin client for service.LookupService with the same get_matches API as MatchIndex"""
+
+    def __init__(self, url=SERVICE_URL, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        info = self._request('/info')
+        self.name_cols = info['name_cols']
+        self.addr_col = info['addr_col']
+        self.sources = info['sources']
+
+    def _request(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        req = Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        with urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read())
+
+    def get_matches(self, names = [], address = ''):
+        """Rows of each source matching the names and address, keyed by source"""
+        matches = self._request('/match', {'names': list(names), 'address': address})['matches']
+        return {k: pd.DataFrame(v) for k,v in matches.items()}
+
+    def search(self, text, field='name'):
+        """Rows of each source whose name contains text, or with field='address' at address text, keyed by source"""
+        matches = self._request('/search?' + urlencode({'q': text, 'field': field}))['matches']
+        return {k: pd.DataFrame(v) for k,v in matches.items()}
+
+    def profile(self, company_id):
+        """Entity names and rows of every source for the entity of company_id"""
+        profile = self._request('/profile?' + urlencode({'company_id': company_id}))
+        profile['sources'] = {k: pd.DataFrame(v) for k,v in profile['sources'].items()}
+        return profile
+
+    def suggest(self, text, k=10):
+        """Top-k (COMPANY_ID, name, score) suggestions for a partly typed name"""
+        hits = self._request('/suggest?' + urlencode({'q': text, 'k': k}))['suggestions']
+        return [(h['COMPANY_ID'], h['name'], h['score']) for h in hits]
+
+    def intervals(self, start, end=None, company_id=None, kinds=None):
+        """Dated rows active on start, or overlapping start..end, of every entity or the entity of company_id"""
+        params = {'start': start, 'end': end, 'company_id': company_id, 'kind': kinds}
+        query = urlencode({k: v for k,v in params.items() if v is not None}, doseq=True)
+        return pd.DataFrame(self._request('/intervals?' + query)['intervals'])
+
+    def neighbors(self, company_id):
+        """COMPANY_IDs directly matched to company_id, with their scores"""
+        return self._request('/neighbors?' + urlencode({'company_id': company_id}))
@@ -0,0 +1,64 @@
+import sqlite3 as sql
+from contextlib import contextmanager
+import pandas as pd
+
+PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-262144',
+    'PRAGMA mmap_size=1073741824',
+]
+
+def connect(path, **kwargs):
+    """Connection in autocommit mode with WAL and bulk-load pragmas, transactions are explicit"""
+    conn = sql.connect(path, isolation_level=None, **kwargs)
+    for p in PRAGMAS:
+        conn.execute(p)
+    return conn
+
+@contextmanager
+def transaction(conn):
+    """Run the block as one transaction, rolled back on error"""
+    conn.execute('BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        # pandas rolls back itself when a query fails
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _sql_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+def _rows(df):
+    return df.astype(object).where(df.notna(), None).values.tolist()
+
+def insert_rows(conn, table, df):
+    """Bulk insert df into an existing table"""
+    cols = ', '.join(_quote(c) for c in df.columns)
+    params = ', '.join('?'*len(df.columns))
+    conn.executemany(f'INSERT INTO {_quote(table)} ({cols}) VALUES ({params})', _rows(df))
+
+def write_table(conn, table, df, primary_key=None, indexes=()):
+    """Replace table with df, typed from its dtypes, then index the given columns"""
+    cols = []
+    for c,dtype in df.dtypes.items():
+        col = f'{_quote(c)} {_sql_type(dtype)}'
+        if c == primary_key:
+            col += ' PRIMARY KEY'
+        cols.append(col)
+    conn.execute(f'DROP TABLE IF EXISTS {_quote(table)}')
+    conn.execute(f'CREATE TABLE {_quote(table)} ({", ".join(cols)})')
+    insert_rows(conn, table, df)
+    for c in indexes:
+        conn.execute(f'CREATE INDEX {_quote(f"ix_{table}_{c}")} ON {_quote(table)} ({_quote(c)})')
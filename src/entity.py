@@ -0,0 +1,99 @@
+import json
+from mapping import mean_score
+import numpy as np
+import pandas as pd
+
+class UnionFind:
+    """Disjoint sets over 0..n-1 with union by size and path halving"""
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+        self.size = [1]*n
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+    def roots(self):
+        return np.array([self.find(x) for x in range(len(self.parent))])
+
+def components(n, a, b):
+    """Component root of each of n nodes joined by edges a[i]-b[i]"""
+    uf = UnionFind(n)
+    for x,y in zip(a.tolist(), b.tolist()):
+        uf.union(x, y)
+    return uf.roots()
+
+def _split(members, a, b, score, max_size):
+    """Split one component by dropping its weakest edges until every part has at most max_size members.
+
+    members are COMPANY_IDs, a/b/score the component's edges. Returns a list of member arrays.
+    """
+    levels = np.unique(score[~np.isnan(score)])
+    if len(members) <= max_size or len(levels) < 2:
+        return [members]
+    keep = score > levels[0]
+    local = {m: i for i,m in enumerate(members.tolist())}
+    la = np.array([local[x] for x in a[keep].tolist()], dtype=int)
+    lb = np.array([local[x] for x in b[keep].tolist()], dtype=int)
+    roots = components(len(members), la, lb)
+
+    parts = []
+    for r in np.unique(roots):
+        part = members[roots==r]
+        inside = keep & np.isin(a, part) & np.isin(b, part)
+        parts.extend(_split(part, a[inside], b[inside], score[inside], max_size))
+    return parts
+
+def resolve_entities(match, graph, max_size=None):
+    """ENTITY_ID (smallest member COMPANY_ID) of every row of match.name_df.
+
+    The MatchGraph's edges are joined into connected components. With max_size, larger
+    components are split by raising the minimum edge score, taken from the graph or
+    recomputed with the FuzzyMatch's scorer, until no part exceeds max_size or the
+    remaining edges all tie.
+    """
+    n = len(match.name_df)
+    a, b = graph.edges()
+    roots = components(n, a, b)
+
+    if max_size is not None:
+        sizes = np.bincount(roots, minlength=n)
+        big = np.nonzero(sizes > max_size)[0]
+        if len(big) > 0:
+            on_big = np.isin(roots[a], big) & (a != b)
+            if graph.scores is not None:
+                score = graph.scores[on_big].astype(float)
+            else:
+                namescore, addrscore = match._score_pairs(a[on_big], b[on_big])
+                score = mean_score(namescore, addrscore)
+            roots = roots.copy()
+            for r in big:
+                edge = on_big & (roots[a]==r)
+                members = np.nonzero(roots==r)[0]
+                edge_score = score[edge[on_big]]
+                for part in _split(members, a[edge], b[edge], edge_score, max_size):
+                    roots[part] = part.min()
+
+    entity = pd.DataFrame({'COMPANY_ID': np.arange(n), 'ROOT': roots})
+    entity['ENTITY_ID'] = entity.groupby('ROOT')['COMPANY_ID'].transform('min')
+    return entity[['COMPANY_ID','ENTITY_ID']]
+
+def entity_members(entity):
+    """One row per entity with its size and JSON list of member COMPANY_IDs"""
+    members = entity.groupby('ENTITY_ID')['COMPANY_ID'].agg(list).reset_index()
+    members['SIZE'] = members['COMPANY_ID'].apply(len)
+    members['COMPANY_IDS'] = members['COMPANY_ID'].apply(lambda x: json.dumps([int(i) for i in x]))
+    return members[['ENTITY_ID','SIZE','COMPANY_IDS']]
@@ -0,0 +1,168 @@
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+import numpy as np
+import pandas as pd
+import pdfplumber
+
+COLS = ['AGENCY','FISCAL_OFFICER','FEIN','EMPLOYER_NAME','EMPLOYER_DBA','ADDRESS','DEBAR_START','DEBAR_END']
+# bump when page parsing changes, so cached pages are parsed again
+PARSER_VERSION = 2
+# words closer than this (pt) belong to the same cell; cells of a line are further apart
+CELL_GAP = 5
+DATE_RE = re.compile(r'(\d{2})[_/](\d{2})[_/](\d{4})')
+FOOTER_RE = re.compile(r'^Page \d+ of \d+$')
+TITLE_RE = re.compile(r'Bureau of Public Work Debarment List|^Article \d+$')
+
+_pdf = None
+
+def _init_worker(path):
+    global _pdf
+    _pdf = pdfplumber.open(path)
+
+def _phrases(words):
+    """Group the words of one line into cells, as (x center, text)"""
+    phrases = []
+    for w in sorted(words, key=lambda w: w['x0']):
+        if phrases and w['x0'] - phrases[-1][1] < CELL_GAP:
+            phrases[-1][1] = w['x1']
+            phrases[-1][2].append(w['text'])
+        else:
+            phrases.append([w['x0'], w['x1'], [w['text']]])
+    return [((x0+x1)/2, ' '.join(t)) for x0,x1,t in phrases]
+
+def parse_page(page):
+    """Table lines of one page as (is header, [(x center, cell text), ...]), without titles and footer.
+
+    The table has no rules, so cells are words grouped by spacing. Columns are assigned
+    later from the last header line, because continuation pages repeat only the title.
+    """
+    lines = {}
+    for w in page.extract_words():
+        lines.setdefault(round(w['top']), []).append(w)
+
+    out = []
+    header = None
+    for top in sorted(lines):
+        phrases = _phrases(lines[top])
+        text = ' '.join(t for _,t in phrases)
+        if TITLE_RE.search(text) or FOOTER_RE.match(text):
+            continue
+        if any(t=='AGENCY' for _,t in phrases):
+            header = top
+            out.append((True, phrases))
+        # the second header line (DBA NAME, START DATE, ...) sits just below the first
+        elif header is None or top > header + 10:
+            out.append((False, phrases))
+    return out
+
+def _parse_page_number(i):
+    return parse_page(_pdf.pages[i])
+
+def page_keys(pdf):
+    """Cache key of every page: a hash of its content streams and the parser version"""
+    keys = []
+    for page in pdf.pages:
+        h = hashlib.sha256(f'v{PARSER_VERSION}'.encode())
+        contents = page.page_obj.contents
+        for stream in contents:
+            h.update(stream.resolve().get_data() if hasattr(stream, 'resolve') else stream.get_data())
+        keys.append(h.hexdigest())
+    return keys
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def extract_pages(path, cache_dir, processes=os.cpu_count()):
+    """Parsed lines of every page, from the cache where possible and in parallel otherwise.
+
+    Pages are cached by content hash, so a new list only parses pages that changed, and a
+    manifest keyed by the file hash skips opening an already ingested PDF at all.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = os.path.join(cache_dir, f'{file_hash(path)}.json')
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            keys = json.load(f)
+    else:
+        with pdfplumber.open(path) as pdf:
+            keys = page_keys(pdf)
+
+    pages = {}
+    for i,k in enumerate(keys):
+        page_path = os.path.join(cache_dir, f'page_{k}.json')
+        if os.path.exists(page_path):
+            with open(page_path) as f:
+                pages[i] = json.load(f)
+    todo = [i for i in range(len(keys)) if i not in pages]
+
+    if todo:
+        with ProcessPoolExecutor(max(1, min(processes, len(todo))), initializer=_init_worker, initargs=(path,)) as pool:
+            for i,rows in zip(todo, pool.map(_parse_page_number, todo)):
+                pages[i] = rows
+                with open(os.path.join(cache_dir, f'page_{keys[i]}.json'), 'w') as f:
+                    json.dump(rows, f)
+    with open(manifest, 'w') as f:
+        json.dump(keys, f)
+    return [pages[i] for i in range(len(keys))], len(todo)
+
+def to_records(pages):
+    """Join table lines into one row per debarment.
+
+    Cells go to the column whose header is nearest, since cell text is centered in its
+    column. A record starts at a line with an AGENCY cell and continues over wrapped lines,
+    also across page breaks. Lines before the first header (the cover page) are skipped.
+    """
+    centers = None
+    records = []
+    for is_header, phrases in (l for p in pages for l in p):
+        if is_header:
+            # AGENCY, Fiscal Officer, FEIN, EMPLOYER NAME, EMPLOYER (DBA), ADDRESS, DEBARMENT x2
+            centers = np.array([x for x,_ in phrases])
+            if len(centers) != len(COLS):
+                raise ValueError(f'Expected {len(COLS)} header columns, found {[t for _,t in phrases]}')
+            continue
+        if centers is None:
+            continue
+        line = {}
+        for x,text in phrases:
+            col = COLS[np.abs(centers - x).argmin()]
+            line[col] = f'{line[col]} {text}' if col in line else text
+        if 'AGENCY' in line or not records:
+            records.append({c: [] for c in COLS})
+        for c,text in line.items():
+            records[-1][c].append(text)
+
+    df = pd.DataFrame([{c: ' '.join(v) for c,v in r.items()} for r in records], columns=COLS)
+    df.insert(0, 'ID', np.arange(1, len(df)+1, dtype=float))
+    return df
+
+def output_path(path, out_dir):
+    """NYSDOL_debarment_<MM_DD_YYYY>.csv, dated like the input file"""
+    m = DATE_RE.search(os.path.basename(path))
+    if m is None:
+        raise ValueError(f'No MM_DD_YYYY date in {path}')
+    return os.path.join(out_dir, f'NYSDOL_debarment_{m.group(1)}_{m.group(2)}_{m.group(3)}.csv')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert an NYSDOL debarment list PDF to the CSV build_db loads')
+    parser.add_argument('pdf', help='e.g. data/raw/NYSDOL_debarment_02_19_2025.pdf')
+    parser.add_argument('--out-dir', default='data/processed')
+    parser.add_argument('--cache-dir', default='data/cache/debarment')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    t0 = time.time()
+    pages, parsed = extract_pages(args.pdf, args.cache_dir, args.processes)
+    df = to_records(pages)
+    out = output_path(args.pdf, args.out_dir)
+    df.to_csv(out, index=False)
+    print(f'Saved {len(df)} debarments to {out} ({parsed} of {len(pages)} pages parsed, {time.time()-t0:.1f}s)')
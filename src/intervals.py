@@ -0,0 +1,147 @@
+from db import write_table
+import numpy as np
+import pandas as pd
+
+TABLE = 'date_interval'
+RTREE = 'date_interval_rtree'
+EPOCH = pd.Timestamp('1970-01-01')
+
+# source -> date columns stored as ISO YYYY-MM-DD text
+DATE_COLS = {
+    'REGISTRY': ['Issued Date', 'Expiration Date', 'Debarment Start Date', 'Debarment End Date'],
+    'DEBARMENT': ['DEBAR_START', 'DEBAR_END'],
+    'APPRENTICE': ['date_signatory_added'],
+    'NYC_AWARDS': [
+        'Prime Contract Start Date', 'Prime Contract End Date', 'Prime Contract Registration Date',
+        'Sub Contract Start Date', 'Sub Contract End Date', 'CONTRACT_START', 'CONTRACT_END',
+    ],
+    'WAGE_THEFT': ['date'],
+    'USDOL': ['findings_start_date', 'findings_end_date'],
+}
+
+# source -> (kind, start column, end column) of the intervals of each row; a missing end
+# column makes a one-day interval, rows without a start date have no interval
+INTERVALS = {
+    'REGISTRY': [
+        ('registration', 'Issued Date', 'Expiration Date'),
+        ('debarment', 'Debarment Start Date', 'Debarment End Date'),
+    ],
+    'DEBARMENT': [('debarment', 'DEBAR_START', 'DEBAR_END')],
+    'NYC_AWARDS': [('contract', 'CONTRACT_START', 'CONTRACT_END')],
+    'WAGE_THEFT': [('wage_theft', 'date', None)],
+    'USDOL': [('findings', 'findings_start_date', 'findings_end_date')],
+}
+
+def parse_dates(s):
+    """Parse a date column that may hold text dates or epoch nanoseconds"""
+    if pd.api.types.is_numeric_dtype(s):
+        return pd.to_datetime(s, errors='coerce')
+    return pd.to_datetime(s, errors='coerce', format='mixed')
+
+def normalize_dates(df, cols):
+    """df with the given date columns as ISO YYYY-MM-DD text, None where there is no valid date"""
+    for c in cols:
+        if c in df.columns:
+            dates = parse_dates(df[c])
+            df[c] = dates.dt.strftime('%Y-%m-%d').astype(object).where(dates.notna(), None)
+    return df
+
+def _days(s):
+    return (parse_dates(s) - EPOCH).dt.days
+
+def day_to_date(days):
+    return (EPOCH + pd.to_timedelta(days, unit='D')).dt.strftime('%Y-%m-%d')
+
+def date_to_day(date):
+    """Day number of a date string or Timestamp"""
+    return (pd.Timestamp(date) - EPOCH).days
+
+def date_intervals(sources):
+    """One row per dated event of the source tables, with its day numbers (days since 1970-01-01).
+
+    sources are the source tables keyed by source, each with a SOURCE_ROWID column (the row's
+    rowid in nyffc.db), COMPANY_ID and its date columns. Intervals ending before they start
+    are kept as one-day intervals at their start.
+    """
+    frames = []
+    for k,spec in INTERVALS.items():
+        if k not in sources:
+            continue
+        df = sources[k]
+        for kind, start, end in spec:
+            if start not in df.columns:
+                continue
+            start_day = _days(df[start])
+            end_day = start_day if end is None else _days(df[end]).fillna(start_day)
+            keep = start_day.notna().values
+            start_day = start_day[keep].astype(np.int64).values
+            frames.append(pd.DataFrame({
+                'SOURCE': k,
+                'KIND': kind,
+                'SOURCE_ROWID': df['SOURCE_ROWID'].values[keep],
+                'COMPANY_ID': df['COMPANY_ID'].values[keep],
+                'START_DAY': start_day,
+                'END_DAY': np.maximum(end_day[keep].astype(np.int64).values, start_day),
+            }))
+
+    cols = ['INTERVAL_ID','SOURCE','KIND','SOURCE_ROWID','COMPANY_ID','START','END','START_DAY','END_DAY']
+    if len(frames)==0:
+        return pd.DataFrame(columns=cols)
+    out = pd.concat(frames, ignore_index=True)
+    out.insert(0, 'INTERVAL_ID', np.arange(len(out)))
+    out['START'] = day_to_date(out['START_DAY'])
+    out['END'] = day_to_date(out['END_DAY'])
+    return out[cols]
+
+def write_intervals(conn, intervals):
+    """Replace the interval table and its R*Tree index over (START_DAY, END_DAY)"""
+    write_table(conn, TABLE, intervals, primary_key='INTERVAL_ID', indexes=['COMPANY_ID'])
+    conn.execute(f'DROP TABLE IF EXISTS {RTREE}')
+    conn.execute(f'CREATE VIRTUAL TABLE {RTREE} USING rtree_i32(INTERVAL_ID, START_DAY, END_DAY)')
+    conn.execute(f'INSERT INTO {RTREE} SELECT INTERVAL_ID, START_DAY, END_DAY FROM {TABLE}')
+
+def overlapping(conn, start, end=None, entity_id=None, kinds=None):
+    """Intervals, with the ENTITY_ID of their company, that overlap start..end (inclusive dates).
+
+    Across all entities the R*Tree finds the overlapping intervals; for one entity its
+    members' intervals are found through the COMPANY_ID index and filtered by date.
+    kinds limits the result to those interval kinds, e.g. ['debarment', 'findings'].
+    """
+    lo = date_to_day(start)
+    hi = lo if end is None else date_to_day(end)
+    params = [hi, lo]
+    if entity_id is None:
+        query = (
+            f'SELECT i.*, e.ENTITY_ID FROM {RTREE} r JOIN {TABLE} i ON i.INTERVAL_ID=r.INTERVAL_ID '
+            'LEFT JOIN entity e ON e.COMPANY_ID=i.COMPANY_ID WHERE r.START_DAY<=? AND r.END_DAY>=?'
+        )
+    else:
+        query = (
+            f'SELECT i.*, e.ENTITY_ID FROM entity e JOIN {TABLE} i ON i.COMPANY_ID=e.COMPANY_ID '
+            'WHERE i.START_DAY<=? AND i.END_DAY>=? AND e.ENTITY_ID=?'
+        )
+        params.append(int(entity_id))
+    if kinds:
+        query += f' AND i.KIND IN ({", ".join("?"*len(kinds))})'
+        params.extend(kinds)
+    return pd.read_sql(query + ' ORDER BY i.INTERVAL_ID', conn, params=params)
+
+def as_of(conn, date, entity_id=None, kinds=None):
+    """Intervals active on date, e.g. debarments in force or contracts running"""
+    return overlapping(conn, date, None, entity_id, kinds)
+
+def during(conn, interval_id, kinds=None, same_entity=True):
+    """Other intervals overlapping interval_id, e.g. debarments or findings during a contract.
+
+    With same_entity only intervals of the interval's own (matched) entity are returned.
+    """
+    row = conn.execute(
+        f'SELECT i.START, i.END, e.ENTITY_ID FROM {TABLE} i LEFT JOIN entity e ON e.COMPANY_ID=i.COMPANY_ID '
+        'WHERE i.INTERVAL_ID=?',
+        (int(interval_id),),
+    ).fetchone()
+    if row is None:
+        raise KeyError(f'Unknown interval {interval_id}')
+    start, end, entity_id = row
+    out = overlapping(conn, start, end, entity_id if same_entity else None, kinds)
+    return out[out['INTERVAL_ID']!=interval_id].reset_index(drop=True)
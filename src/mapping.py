@@ -1,21 +1,113 @@
 
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from fuzzywuzzy import fuzz
 import numpy as np
+import os
 import pandas as pd
 import re
+from address import address_keys
+from profiling import Profiler
+from rapidfuzz import fuzz as rfuzz, process
+from tfidf import TfidfIndex
 from tqdm.auto import tqdm
 
 tqdm.pandas()
 
+ZIP_RE = re.compile(r'(\d{5})\d*\s*$')
+PUNCT_RE = re.compile(r'[^\w\d\s]')
+SPACE_RE = re.compile(r'\s+')
+
+# rapidfuzz equivalents of the fuzzywuzzy scorers, which score the same once rounded to int like
+# fuzzywuzzy. partial_ratio is left out: the two libraries pick different substrings to align.
+RAPIDFUZZ_SCORERS = {
+    fuzz.ratio: rfuzz.ratio,
+    fuzz.token_sort_ratio: rfuzz.token_sort_ratio,
+    fuzz.token_set_ratio: rfuzz.token_set_ratio,
+}
+
+class _PlainScorer:
+    """A two-argument scorer (e.g. fuzz.WRatio) callable by rapidfuzz, which also passes score_cutoff"""
+
+    def __init__(self, fuzzy_alg):
+        self.fuzzy_alg = fuzzy_alg
+
+    def __call__(self, x, y, **kwargs):
+        return self.fuzzy_alg(x, y)
+
+# FuzzyMatch shared with pool workers, set once per process by _init_worker
+_worker_match = None
+
+def _init_worker(match):
+    global _worker_match
+    _worker_match = match
+
+def _match_shard(start, stop):
+    # counters and pair scores are reported per shard and merged by the parent
+    _worker_match.profiler = Profiler()
+    _worker_match.pairs = None if _worker_match.score_floor is None else []
+    return _worker_match._match_rows(start, stop), _worker_match.profiler, _worker_match.pairs
+
+def match_edges(ids, match_ids):
+    """int32 (COMPANY_ID, COMPANY_MATCH) edge arrays from the match list of each of ids"""
+    lens = np.fromiter((len(m) for m in match_ids), dtype=np.int64, count=len(match_ids))
+    a = np.repeat(np.asarray(ids, dtype=np.int32), lens)
+    if len(a)==0:
+        return a, np.array([], dtype=np.int32)
+    return a, np.concatenate(match_ids).astype(np.int32)
+
+def concat_pairs(chunks, score_dtype=np.float16):
+    """(COMPANY_ID, COMPANY_MATCH, name score, address score) arrays of FuzzyMatch.pairs chunks"""
+    dtypes = [np.int32, np.int32, score_dtype, score_dtype]
+    return tuple(np.concatenate([c[i] for c in chunks] + [np.array([], dtype=d)]) for i,d in enumerate(dtypes))
+
+def mean_score(namescore, addrscore):
+    """Mean of name and address scores, the other one where one is NaN (empty string), NaN where both are"""
+    dtype = np.result_type(namescore, np.float32)
+    name = np.asarray(namescore, dtype=dtype)
+    addr = np.asarray(addrscore, dtype=dtype)
+    return np.where(np.isnan(name), addr, np.where(np.isnan(addr), name, (name + addr) / 2))
+
+def _ranges(counts):
+    """Concatenated aranges 0..c-1 for each of counts"""
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.arange(starts.size) - starts
+
+def encode_columns(df, cols):
+    """df with cols as Categoricals sharing one dictionary of distinct strings, with '' as code 0.
+
+    Returns df itself when its columns already share such a dictionary.
+    """
+    dtype = df[cols[0]].dtype
+    if (
+        isinstance(dtype, pd.CategoricalDtype) and len(dtype.categories)>0 and dtype.categories[0]==''
+        and all(df[c].dtype is dtype for c in cols)
+    ):
+        return df
+    values = np.concatenate([np.array([''], dtype=object)] + [df[c].to_numpy(dtype=object) for c in cols])
+    codes, strings = pd.factorize(values)
+    dtype = pd.CategoricalDtype(strings)
+    df = df.copy()
+    for i,c in enumerate(cols):
+        df[c] = pd.Categorical.from_codes(codes[1+i*len(df):1+(i+1)*len(df)], dtype=dtype)
+    return df
+
 def norm_string(s):
     """Remove punctuation and lowercasing"""
     if isinstance(s,str):
         s = s.lower().replace('&','and')
-        s = re.sub(r'[^\w\d\s]','',s)
-        s = re.sub(r'\s+',' ',s)
+        s = PUNCT_RE.sub('',s)
+        s = SPACE_RE.sub(' ',s)
         return s
     return ''
 
+def norm_series(s):
+    """norm_string over a Series, normalizing each distinct value once"""
+    codes, uniques = pd.factorize(s)
+    # missing values get code -1, which picks the trailing ''
+    normed = np.array([norm_string(u) for u in uniques] + [''], dtype=object)
+    return pd.Series(normed[codes], index=s.index)
+
 class FuzzyMatch:
 
     def __init__(
@@ -25,35 +117,409 @@ class FuzzyMatch:
         threshold=95,
         avg_threshold=80,
         fuzzy_alg=fuzz.ratio,
+        block_size=None,
+        ngram=3,
+        engine='apply',
+        workers=1,
+        batch_size=256,
+        processes=1,
+        chunk_size=2048,
+        profiler=None,
+        top_n=20,
+        tfidf_cutoff=0.5,
+        max_df=0.05,
+        rescore=True,
+        score_floor=None,
     ):
         self.name_cols = name_cols
         self.addr_col = addr_col
         self.threshold = threshold
         self.avg_threshold = avg_threshold
         self.fuzzy_alg = fuzzy_alg
+        self.block_size = block_size
+        self.ngram = ngram
+        self.blocks = None
+        self.tfidf = None
+        self._name_df = None
+        if engine not in ('apply', 'cdist', 'tfidf'):
+            raise ValueError(f"Unknown engine '{engine}', expected 'apply', 'cdist' or 'tfidf'")
+        self.engine = engine
+        self.workers = workers
+        self.batch_size = batch_size
+        self.processes = os.cpu_count() if processes==-1 else processes
+        self.chunk_size = chunk_size
+        self.profiler = Profiler() if profiler is None else profiler
+        self.top_n = top_n
+        self.tfidf_cutoff = tfidf_cutoff
+        self.max_df = max_df
+        self.rescore = rescore
+        if score_floor is not None and engine=='apply':
+            raise ValueError("score_floor needs the 'cdist' or 'tfidf' engine")
+        self.score_floor = score_floor
+        # (COMPANY_ID, COMPANY_MATCH, name score, address score) chunks of the pairs passing score_floor
+        self.pairs = None
+        # other scorers run as they are, one Python call per pair, so every engine gives the same scores
+        self.scorer = RAPIDFUZZ_SCORERS.get(fuzzy_alg) or _PlainScorer(fuzzy_alg)
+        # float16 holds the rounded 0-100 scores exactly, other scores keep full precision
+        integer_scores = fuzzy_alg in RAPIDFUZZ_SCORERS and (engine!='tfidf' or rescore)
+        self.score_dtype = np.float16 if integer_scores else np.float64
+        # scores below this can never pass both thresholds (or the floor), so rapidfuzz may skip them
+        lowest = threshold if score_floor is None else min(threshold, score_floor)
+        lowest_avg = avg_threshold if score_floor is None else min(avg_threshold, score_floor)
+        self.score_cutoff = max(0, min(lowest, 2*lowest_avg-100) - 1)
+
+    @property
+    def name_df(self):
+        return self._name_df
+
+    @name_df.setter
+    def name_df(self, df):
+        """Store name_df dictionary-encoded, see encode_columns, and keep the codes of each column"""
+        if df is not None and df is not self._name_df:
+            cols = self.name_cols + [self.addr_col]
+            df = encode_columns(df, cols)
+            self._strings = np.asarray(df[cols[0]].cat.categories, dtype=object)
+            self._codes = {c: df[c].cat.codes.to_numpy().astype(np.int32) for c in cols}
+            self._distinct_codes = {}
+            self._distinct_row_index = {}
+        self._name_df = df
+
+    def _distinct(self, col, rows=None):
+        """(distinct codes, inverse) of a name_df column, or of some of its rows; whole columns are cached"""
+        if rows is not None:
+            return np.unique(self._codes[col][rows], return_inverse=True)
+        if col not in self._distinct_codes:
+            self._distinct_codes[col] = np.unique(self._codes[col], return_inverse=True)
+        return self._distinct_codes[col]
+
+    def _score_strings(self, queries, distinct):
+        """_score_matrix of queries against _distinct codes of a column, scoring each distinct string once"""
+        codes, inverse = distinct
+        return self._score_matrix(queries, self._strings[codes])[:, inverse]
+
+    def _score_code_pairs(self, a, b):
+        """Pairwise _score_matrix of the strings with codes a[i], b[i], scoring each distinct pair once"""
+        n = len(self._strings)
+        pairs, keys = pd.factorize(a.astype(np.int64)*n + b)
+        return self._score_matrix(self._strings[keys // n], self._strings[keys % n], pairwise=True)[pairs]
+
+    def _apply_scores(self, query, distinct):
+        """_score of every string of _distinct codes against query, one call per distinct string"""
+        codes, inverse = distinct
+        return np.array([self._score(x, query) for x in self._strings[codes]], dtype=float)[inverse]
 
     def _score(self, x, y):
         if (len(x)>0) & (len(y)>0):
             return self.fuzzy_alg(x,y)
         return np.nan
 
-    def _get_match_idx(self, names = [], address = ''):
+    def _score_matrix(self, queries, choices, pairwise=False):
+        """Score queries against choices in one rapidfuzz call, NaN where either string is empty"""
+        queries = np.asarray(queries, dtype=object)
+        choices = np.asarray(choices, dtype=object)
+        scorer = process.cpdist if pairwise else process.cdist
+        scores = scorer(
+            queries, choices, 
+            scorer=self.scorer, 
+            score_cutoff=self.score_cutoff, 
+            workers=self.workers,
+        ).astype(float)
+        if self.fuzzy_alg in RAPIDFUZZ_SCORERS:
+            scores = np.rint(scores)
+        q_empty = queries == ''
+        c_empty = choices == ''
+        if pairwise:
+            scores[q_empty | c_empty] = np.nan
+        else:
+            scores[q_empty, :] = np.nan
+            scores[:, c_empty] = np.nan
+        return scores
+
+    def _keep(self, namescore, addrscore, threshold=None, avg_threshold=None):
+        threshold = self.threshold if threshold is None else threshold
+        avg_threshold = self.avg_threshold if avg_threshold is None else avg_threshold
+        score = mean_score(namescore, addrscore)
+        return (score>=avg_threshold) & ((namescore>=threshold)|(addrscore>=threshold))
 
-        namescore = []
+    def _filter(self, a, b, namescore, addrscore):
+        """Mask of the pairs passing the thresholds, after keeping those passing score_floor in pairs"""
+        if self.pairs is None:
+            return self._keep(namescore, addrscore)
+        floor = self._keep(namescore, addrscore, self.score_floor, self.score_floor)
+        self.pairs.append((
+            a[floor].astype(np.int32), b[floor].astype(np.int32),
+            namescore[floor].astype(self.score_dtype), addrscore[floor].astype(self.score_dtype),
+        ))
+        return self._keep(namescore, addrscore)
+
+    def _block_keys(self, names = [], address = ''):
+        """Blocking keys for a record: exact names, name tokens, name n-grams, address tokens, zip code
+        and parsed (zip, house number, street stem)"""
+        keys = set()
         for n in names:
-            for c in self.name_cols:
-                namescore.append(np.vstack(self.name_df[c].apply(lambda x: self._score(x, n)).values))
-        namescore = np.nanmax(np.concatenate(namescore,axis=1),axis=1)
+            if len(n)==0:
+                continue
+            keys.add(('n', n))
+            keys.update(('t', t) for t in n.split())
+            keys.update(('g', n[i:i+self.ngram]) for i in range(max(len(n)-self.ngram, 0)+1))
+        keys.update(('a', t) for t in address.split())
+        zipcode = ZIP_RE.search(address)
+        if zipcode:
+            keys.add(('z', zipcode.group(1)))
+        keys.update(address_keys(address))
+        return keys
+
+    def _block_members(self, ids=None):
+        """Blocking key -> COMPANY_IDs of every name_df row, or of the rows of ids, whatever the block's size"""
+        rows = self.name_df['COMPANY_ID'].values
+        if ids is not None:
+            rows = rows[np.isin(rows, ids)]
+        blocks = defaultdict(list)
+        cols = [self._strings[self._codes[c][rows]] for c in self.name_cols + [self.addr_col]]
+        for row in zip(rows, *cols):
+            for k in self._block_keys(row[1:-1], row[-1]):
+                blocks[k].append(row[0])
+        return blocks
+
+    def _build_blocks(self, ids=None):
+        """Inverted index from blocking key to COMPANY_IDs (of the rows of ids), dropping blocks larger than block_size"""
+        blocks = self._block_members(ids)
+        self.blocks = {k: np.array(v) for k,v in blocks.items() if len(v)<=self.block_size}
+        return blocks
+
+    def _candidates(self, names = [], address = ''):
+        """COMPANY_IDs sharing at least one block with the record"""
+        ids = [self.blocks[k] for k in self._block_keys(names, address) if k in self.blocks]
+        if len(ids)==0:
+            return np.array([], dtype=int)
+        return np.unique(np.concatenate(ids))
+
+    def _build_tfidf(self):
+        """TF-IDF indexes of the distinct non-empty names (of every name column) and addresses, with
+        the COMPANY_IDs of each string"""
+        ids = self.name_df['COMPANY_ID'].values
+        self.tfidf = {}
+        for key, cols in (('names', self.name_cols), ('address', [self.addr_col])):
+            codes, inverse = np.unique(np.concatenate([self._codes[c] for c in cols]), return_inverse=True)
+            order = np.argsort(inverse, kind='stable')
+            offsets = np.searchsorted(inverse[order], np.arange(len(codes)+1))
+            # '' never becomes a neighbor: its row has no n-grams
+            index = TfidfIndex(self._strings[codes], self.ngram, self.max_df)
+            self.tfidf[key] = (index, codes, np.tile(ids, len(cols))[order], offsets)
+
+    def _tfidf_vectors(self, col, rows):
+        """TF-IDF rows of the strings of a name_df column at rows"""
+        index, codes = self.tfidf['address' if col==self.addr_col else 'names'][:2]
+        return index.matrix[np.searchsorted(codes, self._codes[col][rows])]
+
+    def _index_candidates(self):
+        """Build the candidate index of the engine: TF-IDF neighbors, or blocks when block_size is set"""
+        if self.engine=='tfidf':
+            with self.profiler.stage('tfidf'):
+                self._build_tfidf()
+        elif self.block_size is not None:
+            with self.profiler.stage('blocks'):
+                self._build_blocks()
+
+    def _tfidf_candidates(self, batch):
+        """(batch row, COMPANY_ID) pairs, sorted, of the COMPANY_IDs of the top_n distinct TF-IDF neighbor
+        strings of each batch row's names and address above tfidf_cutoff, and of each row with itself"""
+        rows = [np.arange(len(batch))]
+        matches = [batch['COMPANY_ID'].values]
+        for key, cols in (('names', self.name_cols), ('address', [self.addr_col])):
+            index, _, owners, offsets = self.tfidf[key]
+            for c in cols:
+                queries = self._tfidf_vectors(c, batch['COMPANY_ID'].values)
+                r, j, _ = index.top_n(queries, self.top_n, self.tfidf_cutoff)
+                # each neighboring string stands for every COMPANY_ID that has it
+                counts = offsets[j+1] - offsets[j]
+                rows.append(np.repeat(r, counts))
+                matches.append(owners[np.repeat(offsets[j], counts) + _ranges(counts)])
+        n = len(self.name_df)
+        pairs = np.unique(np.concatenate(rows).astype(np.int64)*n + np.concatenate(matches))
+        return pairs // n, pairs % n
+
+    def _tfidf_score_pairs(self, a, b):
+        """Name and address cosine similarities (0-100) for pairs of COMPANY_IDs, NaN where either is empty"""
+        def cosine(q, c):
+            score = np.asarray(self._tfidf_vectors(q, a).multiply(self._tfidf_vectors(c, b)).sum(axis=1)).ravel() * 100
+            empty = (self._codes[q][a]==0) | (self._codes[c][b]==0)
+            return np.where(empty, np.nan, score)
+        namescore = np.fmax.reduce([cosine(q, c) for q in self.name_cols for c in self.name_cols])
+        return namescore, cosine(self.addr_col, self.addr_col)
+
+    def _get_match_idx(self, names = [], address = '', candidates = None):
+
+        rows = np.arange(len(self.name_df)) if candidates is None else self.name_df.index.get_indexer(candidates)
+        self.profiler.count('pairs_scored', len(rows))
+        self.profiler.observe('candidates_per_query', [len(rows)])
+        if len(rows)==0:
+            return []
+
+        # each distinct string of the candidate rows is scored once, then broadcast back to its rows
+        distinct = {c: self._distinct(c, None if candidates is None else rows) for c in self.name_cols + [self.addr_col]}
+        # address-only lookups have no name score
+        namescore = np.full(len(rows), np.nan)
+        if self.engine!='apply':
+            if len(names)>0:
+                namescore = np.fmax.reduce(np.vstack([self._score_strings(names, distinct[c]) for c in self.name_cols]))
+            addrscore = self._score_strings([address], distinct[self.addr_col])[0]
+        else:
+            if len(names)>0:
+                namescore = np.fmax.reduce([self._apply_scores(n, distinct[c]) for n in names for c in self.name_cols])
+            addrscore = self._apply_scores(address, distinct[self.addr_col])
+
+        return list(self.name_df.index.values[rows[self._keep(namescore, addrscore)]])
+
+    def _get_match_idx_batch(self, queries):
+        """_get_match_idx for a list of (names, address) queries, scored with one rapidfuzz call per column.
 
-        addrscore = self.name_df[self.addr_col].apply(lambda x: self._score(x, address))
+        A kept row scores at least threshold on a name or on its address, so only rows whose
+        distinct strings reach it are expanded from the per-string scores and compared.
+        """
+        self.profiler.count('pairs_scored', len(queries)*len(self.name_df))
+        names = [n for q in queries for n in q[0]]
+        counts = np.array([len(q[0]) for q in queries], dtype=int)
+        owner = np.repeat(np.arange(len(queries)), counts)
+        # (query, slot) -> index into names, -1 for the slots of queries with fewer names
+        slots = np.full((len(queries), counts.max(initial=0)), -1)
+        slots[owner, np.arange(len(names)) - np.repeat(np.cumsum(counts) - counts, counts)] = np.arange(len(names))
 
-        score = np.nanmean([namescore, addrscore],axis=0)
+        namescores = {c: self._score_matrix(names, self._strings[self._distinct(c)[0]]) for c in self.name_cols}
+        addrscores = self._score_matrix([q[1] for q in queries], self._strings[self._distinct(self.addr_col)[0]])
+        hits = [self._hit_rows(namescores[c], owner, c) for c in self.name_cols]
+        hits.append(self._hit_rows(addrscores, np.arange(len(queries)), self.addr_col))
+        n = len(self.name_df)
+        pair = np.unique(np.concatenate([q*n + r for q,r in hits]))
+        query, rows = pair // n, pair % n
 
-        return list(self.name_df[
-            (score>=self.avg_threshold) & ((namescore>=self.threshold)|(addrscore>=self.threshold))
-        ].index)
+        namescore = np.full(len(pair), np.nan)
+        for c in self.name_cols:
+            score = namescores[c][slots[query], self._distinct(c)[1][rows, None]]
+            namescore = np.fmax(namescore, np.fmax.reduce(np.where(slots[query]>=0, score, np.nan), axis=1, initial=np.nan))
+        addrscore = addrscores[query, self._distinct(self.addr_col)[1][rows]]
+        keep = self._keep(namescore, addrscore)
+        query, matches = query[keep], self.name_df.index.values[rows[keep]]
+        return [list(m) for m in np.split(matches, np.searchsorted(query, np.arange(1, len(queries))))]
+
+    def _hit_rows(self, scores, owner, col):
+        """(query, row) of every name_df row whose distinct string of col scores at least threshold
+        for one of the query strings, scores being a _score_matrix against the column's distinct strings"""
+        order, offsets = self._distinct_rows(col)
+        s, d = np.nonzero(scores >= self.threshold)
+        counts = offsets[d+1] - offsets[d]
+        starts = np.repeat(offsets[d] - (np.cumsum(counts) - counts), counts)
+        return np.repeat(owner[s], counts), order[starts + np.arange(counts.sum())]
+
+    def _distinct_rows(self, col):
+        """(rows, offsets) of name_df grouped by distinct string of col: the rows of the i-th string
+        of _distinct(col) are rows[offsets[i]:offsets[i+1]]"""
+        if col not in self._distinct_row_index:
+            codes, inverse = self._distinct(col)
+            order = np.argsort(inverse, kind='stable')
+            self._distinct_row_index[col] = order, np.searchsorted(inverse[order], np.arange(len(codes)+1))
+        return self._distinct_row_index[col]
+
+    def _score_pairs(self, a, b):
+        """Name and address scores for pairs of COMPANY_IDs a[i], b[i], scoring each distinct pair of strings once"""
+        k = len(self.name_cols)
+        namescore = np.fmax.reduce(self._score_code_pairs(
+            np.concatenate([self._codes[q][a] for q in self.name_cols for c in self.name_cols]),
+            np.concatenate([self._codes[c][b] for q in self.name_cols for c in self.name_cols]),
+        ).reshape(k*k, len(a)))
+        addrscore = self._score_code_pairs(self._codes[self.addr_col][a], self._codes[self.addr_col][b])
+        return namescore, addrscore
+
+    def _match_batch(self, ids):
+        """Match a batch of name_df rows, scoring each column pair as one rapidfuzz call"""
+        batch = self.name_df.loc[ids]
+        if self.blocks is None and self.engine=='cdist':
+            b = batch['COMPANY_ID'].values
+            namescore = np.fmax.reduce([
+                self._score_strings(self._strings[self._codes[q][b]], self._distinct(c))
+                for q in self.name_cols for c in self.name_cols
+            ])
+            addrscore = self._score_strings(self._strings[self._codes[self.addr_col][b]], self._distinct(self.addr_col))
+            if self.pairs is None:
+                rows, cols = np.nonzero(self._keep(namescore, addrscore))
+            else:
+                # only pairs passing the floor are worth flattening
+                rows, cols = np.nonzero(self._keep(namescore, addrscore, self.score_floor, self.score_floor))
+                keep = self._filter(b[rows], self.name_df['COMPANY_ID'].values[cols], namescore[rows, cols], addrscore[rows, cols])
+                rows, cols = rows[keep], cols[keep]
+            matches = self.name_df['COMPANY_ID'].values[cols]
+            self.profiler.count('pairs_scored', len(batch)*len(self.name_df))
+            self.profiler.observe('candidates_per_query', [len(self.name_df)]*len(batch))
+        else:
+            if self.engine=='tfidf':
+                rows, matches = self._tfidf_candidates(batch)
+            else:
+                cands = [
+                    np.union1d(self._candidates(r[1:-1], r[-1]), [r[0]])
+                    for r in zip(batch['COMPANY_ID'], *[batch[c] for c in self.name_cols], batch[self.addr_col])
+                ]
+                rows = np.repeat(np.arange(len(batch)), [len(c) for c in cands])
+                matches = np.concatenate(cands).astype(int)
+            self.profiler.count('pairs_scored', len(matches))
+            self.profiler.observe('candidates_per_query', np.bincount(rows, minlength=len(batch)))
+            a = batch['COMPANY_ID'].values[rows]
+            if self.engine=='tfidf' and not self.rescore:
+                namescore, addrscore = self._tfidf_score_pairs(a, matches)
+            else:
+                namescore, addrscore = self._score_pairs(a, matches)
+            keep = self._filter(a, matches, namescore, addrscore)
+            rows, matches = rows[keep], matches[keep]
+        return np.split(matches.astype(np.int32), np.searchsorted(rows, np.arange(1, len(batch))))
+
+    def _match_rows(self, start, stop):
+        """Match lists for name_df rows start:stop"""
+        return self._match_list(self.name_df.index[start:stop])
+
+    def _match_list(self, ids):
+        """Match lists for the name_df rows of COMPANY_IDs ids"""
+        if self.engine!='apply':
+            match_ids = []
+            for s in range(0, len(ids), self.batch_size):
+                match_ids.extend(self._match_batch(ids[s:s+self.batch_size]))
+            return match_ids
+
+        rows = self.name_df.loc[ids]
+        match_ids = []
+        for r in zip(rows['COMPANY_ID'], *[rows[c] for c in self.name_cols], rows[self.addr_col]):
+            candidates = None
+            if self.blocks is not None:
+                candidates = np.union1d(self._candidates(r[1:-1], r[-1]), [r[0]])
+            match_ids.append(self._get_match_idx(r[1:-1], r[-1], candidates=candidates))
+        return match_ids
+
+    def _match_parallel(self, start, stop):
+        """Match name_df rows start:stop in shards of chunk_size rows on a process pool, merged in row order"""
+        shards = {}
+        pairs = {}
+        # workers get name_df and blocks once through the initializer, tasks only carry row ranges
+        with ProcessPoolExecutor(self.processes, initializer=_init_worker, initargs=(self,)) as pool, tqdm(total=stop-start) as pbar:
+            futures = {
+                pool.submit(_match_shard, s, min(s+self.chunk_size, stop)): s
+                for s in range(start, stop, self.chunk_size)
+            }
+            for f in as_completed(futures):
+                shards[futures[f]], profiler, pairs[futures[f]] = f.result()
+                self.profiler.merge(profiler)
+                pbar.update(len(shards[futures[f]]))
+        if self.pairs is not None:
+            self.pairs.extend(p for s in sorted(pairs) for p in pairs[s])
+        return [m for s in sorted(shards) for m in shards[s]]
+
+    def _match_range(self, start, stop):
+        """Match lists for name_df rows start:stop, serial or on a process pool"""
+        if self.processes > 1:
+            return self._match_parallel(start, stop)
+        match_ids = []
+        for s in tqdm(range(start, stop, self.batch_size)):
+            match_ids.extend(self._match_rows(s, min(s+self.batch_size, stop)))
+        return match_ids
     
-    def _company_indexes(self, df_dict):
+    def _normalize(self, df_dict):
 
         cols = self.name_cols + [self.addr_col]
 
@@ -61,31 +527,125 @@ class FuzzyMatch:
             for col in cols:
                 if col not in v.columns:
                     v[col] = ''
-                v[col] = v[col].apply(lambda x: norm_string(x))
+                v[col] = norm_series(v[col])
             df_dict[k] = v
 
-        name_df = pd.concat([v[cols] for v in df_dict.values()])
-        name_df = name_df.drop_duplicates().reset_index(drop=True)
-        name_df.reset_index(drop=False, inplace=True)
-        name_df.rename(columns={'index':'COMPANY_ID'}, inplace=True)
+        return df_dict
+
+    def _merge_ids(self, name_df, df_dict):
+
+        cols = self.name_cols + [self.addr_col]
 
         for k,v in df_dict.items():
             v = v.merge(name_df, how='left', on=cols)
             v.drop(cols, axis=1, inplace=True)
             df_dict[k] = v
 
-        return name_df, df_dict
+        return df_dict
+
+    def _company_indexes(self, df_dict):
+
+        cols = self.name_cols + [self.addr_col]
+        with self.profiler.stage('normalize'):
+            df_dict = self._normalize(df_dict)
+
+        name_df = pd.concat([v[cols] for v in df_dict.values()])
+        name_df = name_df.drop_duplicates().reset_index(drop=True)
+        name_df.reset_index(drop=False, inplace=True)
+        name_df.rename(columns={'index':'COMPANY_ID'}, inplace=True)
+
+        return name_df, self._merge_ids(name_df, df_dict)
     
     def index_and_match(self, df_dict):
-        self.name_df, df_dict = self._company_indexes(df_dict)
-        match_ids = self.name_df.progress_apply(lambda x: self._get_match_idx(
-                x[self.name_cols], 
-                x[self.addr_col],
-            ), axis=1)
+        with self.profiler.stage('company_indexes'):
+            self.name_df, df_dict = self._company_indexes(df_dict)
+        self.profiler.count('name_rows', len(self.name_df))
+        self._index_candidates()
+        self.pairs = None if self.score_floor is None else []
+        with self.profiler.stage('match'):
+            match_ids = self._match_range(0, len(self.name_df))
         
-        match_df = pd.concat([self.name_df['COMPANY_ID'],pd.DataFrame(match_ids.to_list())],axis=1)
-        match_df = match_df.melt(id_vars='COMPANY_ID').dropna(subset='value').reset_index(drop=True).drop(columns=['variable'])
-        match_df.reset_index(drop=False, inplace=True)
-        match_df.rename(columns={'index':'MATCH_ID','value':'COMPANY_MATCH'}, inplace=True)
+        with self.profiler.stage('edges'):
+            a, b = match_edges(self.name_df['COMPANY_ID'].values, match_ids)
+            del match_ids
+            match_df = pd.DataFrame({'MATCH_ID': np.arange(len(a), dtype=np.int32), 'COMPANY_ID': a, 'COMPANY_MATCH': b})
+        self.profiler.count('edges', len(match_df))
         
-        return match_df.astype(int), df_dict
\ No newline at end of file
+        return match_df, df_dict
+
+    def update_and_match(self, df_dict, name_df, match_df, old_ids=None, kept_ids=None):
+        """Index changed sources against an existing name_df and match only the rows whose matches may change.
+
+        Existing COMPANY_IDs are kept and new name/address rows are appended after them.
+        old_ids are the COMPANY_IDs the sources referenced before the update and kept_ids
+        those of the sources that did not change (both default to every existing row).
+        Rows no source references any more stay in name_df but lose their edges, and blocks
+        are built over the referenced rows, as a full rebuild would. The new rows are matched,
+        and so are existing rows in a block that crossed block_size either way, since their
+        candidates changed. Scores are symmetric, so edges from the other rows to matched rows
+        are the reverse of the matched rows' own. With the tfidf engine neighbors also depend
+        on the new strings, so results can differ from a full rebuild.
+
+        Returns the new match rows, the new name rows, df_dict and the existing COMPANY_IDs
+        whose old match rows (in either column) are replaced.
+        """
+        cols = self.name_cols + [self.addr_col]
+        with self.profiler.stage('normalize'):
+            df_dict = self._normalize(df_dict)
+
+        new_df = pd.concat([v[cols] for v in df_dict.values()]).drop_duplicates()
+        new_df = new_df.merge(name_df[cols], how='left', on=cols, indicator=True)
+        new_df = new_df[new_df['_merge']=='left_only'].drop(columns='_merge').reset_index(drop=True)
+        start = len(name_df)
+        new_df.insert(0, 'COMPANY_ID', np.arange(start, start+len(new_df)))
+
+        name_df = pd.concat([name_df, new_df], ignore_index=True)
+        df_dict = self._merge_ids(name_df, df_dict)
+        self.name_df = name_df
+        self.profiler.count('name_rows', len(new_df))
+
+        live = np.ones(len(name_df), dtype=bool)
+        if kept_ids is not None:
+            live[:] = False
+            live[np.asarray(kept_ids, dtype=int)] = True
+            for v in df_dict.values():
+                live[v['COMPANY_ID'].values.astype(int)] = True
+        old_live = np.arange(start) if old_ids is None else np.unique(np.asarray(old_ids, dtype=int))
+        live_ids = np.nonzero(live)[0]
+        rematch = np.array([], dtype=int)
+        if self.engine=='tfidf':
+            self._index_candidates()
+        elif self.block_size is not None:
+            with self.profiler.stage('blocks'):
+                old_sizes = {k: len(v) for k,v in self._block_members(old_live).items()}
+                blocks = self._build_blocks(live_ids)
+            crossed = [v for k,v in blocks.items() if (old_sizes.get(k, 0) <= self.block_size) != (len(v) <= self.block_size)]
+            if crossed:
+                rematch = np.unique(np.concatenate(crossed))
+                rematch = rematch[rematch < start]
+        self.profiler.count('rows_rematched', len(rematch))
+
+        self.pairs = None if self.score_floor is None else []
+        with self.profiler.stage('match'):
+            match_ids = self._match_list(rematch) + self._match_range(start, len(self.name_df))
+
+        matched = np.zeros(len(name_df), dtype=bool)
+        matched[rematch] = True
+        matched[start:] = True
+        a, b = match_edges(np.concatenate([rematch, new_df['COMPANY_ID'].values]), match_ids)
+        keep = live[b]
+        a, b = a[keep], b[keep]
+        reverse = ~matched[b]
+        new_match = pd.DataFrame({'COMPANY_ID': np.concatenate([a, b[reverse]]), 'COMPANY_MATCH': np.concatenate([b, a[reverse]])})
+        first_id = match_df['MATCH_ID'].max()+1 if len(match_df)>0 else 0
+        new_match.insert(0, 'MATCH_ID', np.arange(first_id, first_id+len(new_match), dtype=np.int32))
+        if self.pairs is not None:
+            # the same for the pair scores: matched rows' pairs, then their reverse from the other rows
+            a, b, namescore, addrscore = concat_pairs(self.pairs, self.score_dtype)
+            keep = live[b]
+            a, b, namescore, addrscore = a[keep], b[keep], namescore[keep], addrscore[keep]
+            reverse = ~matched[b]
+            self.pairs = [(a, b, namescore, addrscore), (b[reverse], a[reverse], namescore[reverse], addrscore[reverse])]
+
+        stale = np.union1d(rematch, np.setdiff1d(np.arange(start), live_ids))
+        return new_match, new_df, df_dict, stale
@@ -0,0 +1,67 @@
+from match_index import map_arrays, write_arrays
+import numpy as np
+
+MAGIC = b'NYFFCGR1'
+
+class MatchGraph:
+    """Match edges in CSR form: the neighbors of COMPANY_ID i are neighbors[offsets[i]:offsets[i+1]].
+
+    neighbors are int32 COMPANY_IDs sorted within each row and scores, when present, the
+    float32 mean of the name and address scores of each edge. A graph opened from a file
+    is memory-mapped, so neighbor lookups are O(degree) and do not touch the match table.
+    """
+
+    def __init__(self, offsets, neighbors, scores=None):
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.scores = scores
+
+    @classmethod
+    def from_edges(cls, n, a, b, scores=None):
+        """Graph over n COMPANY_IDs from edges a[i] -> b[i]"""
+        a = np.asarray(a, dtype=np.int32)
+        b = np.asarray(b, dtype=np.int32)
+        order = np.lexsort((b, a))
+        offsets = np.zeros(n+1, dtype=np.int64)
+        np.cumsum(np.bincount(a, minlength=n), out=offsets[1:])
+        if scores is not None:
+            scores = np.asarray(scores, dtype=np.float32)[order]
+        return cls(offsets, b[order], scores)
+
+    @classmethod
+    def open(cls, path):
+        mm, header, arrays = map_arrays(path, MAGIC)
+        graph = cls(arrays['offsets'], arrays['neighbors'], arrays.get('scores'))
+        graph._mm = mm
+        return graph
+
+    def save(self, path):
+        arrays = {'offsets': self.offsets.astype('<i8'), 'neighbors': self.neighbors.astype('<i4')}
+        if self.scores is not None:
+            arrays['scores'] = self.scores.astype('<f4')
+        write_arrays(path, MAGIC, {'nodes': len(self), 'edges': self.n_edges}, arrays)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def n_edges(self):
+        return len(self.neighbors)
+
+    def degree(self, i=None):
+        """Number of matches of COMPANY_ID i, or of every COMPANY_ID"""
+        if i is None:
+            return np.diff(self.offsets)
+        return int(self.offsets[i+1] - self.offsets[i])
+
+    def neighbors_of(self, i):
+        """COMPANY_IDs matched to COMPANY_ID i"""
+        return self.neighbors[self.offsets[i]:self.offsets[i+1]]
+
+    def scores_of(self, i):
+        return None if self.scores is None else self.scores[self.offsets[i]:self.offsets[i+1]]
+
+    def edges(self):
+        """(COMPANY_ID, COMPANY_MATCH) int32 arrays of every edge, ordered by COMPANY_ID"""
+        a = np.repeat(np.arange(len(self), dtype=np.int32), self.degree())
+        return a, self.neighbors
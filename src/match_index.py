@@ -0,0 +1,295 @@
+from address import AddressIndex
+from mapping import FuzzyMatch, encode_columns
+from query_cache import QueryCache
+from fuzzywuzzy import fuzz
+import hashlib
+import json
+import mmap
+import numpy as np
+import os
+import pandas as pd
+from rapidfuzz import fuzz as rfuzz, process
+
+MAGIC = b'NYFFCIX2'
+# queries scored per FuzzyMatch._get_match_idx_batch call, past this batches were measured to get slower
+BATCH_SIZE = 32
+
+def _align(n, size=8):
+    return (n + size - 1) // size * size
+
+def write_arrays(path, magic, header, arrays):
+    """Write magic, a JSON header and 8-byte aligned flat arrays that map_arrays can map back.
+
+    The file is written aside and moved over path, so processes still mapping the previous
+    file (the service, screen) keep reading it intact instead of a truncated one.
+    """
+    header = dict(header, arrays={})
+    # header size depends on the offsets it records, so lay out the arrays after a generous estimate
+    estimate = _align(len(json.dumps(header)) + 200*len(arrays))
+    offset = len(magic) + 8 + estimate
+    for k,a in arrays.items():
+        header['arrays'][k] = {'dtype': a.dtype.str, 'count': len(a), 'offset': offset}
+        offset = _align(offset + a.nbytes)
+    header_bytes = json.dumps(header).encode('utf-8')
+    if len(header_bytes) > estimate:
+        raise ValueError(f'{path} header does not fit its reserved space')
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(magic)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for k,a in arrays.items():
+            f.seek(header['arrays'][k]['offset'])
+            f.write(a.tobytes())
+    os.replace(path + '.tmp', path)
+
+def map_arrays(path, magic):
+    """(mmap, header, arrays) of a file written by write_arrays, arrays are views on the mapping"""
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:len(magic)] != magic:
+        raise ValueError(f"{path} is not a {magic.decode()} file")
+    header_len = int.from_bytes(mm[len(magic):len(magic)+8], 'little')
+    header = json.loads(mm[len(magic)+8:len(magic)+8+header_len])
+    arrays = {
+        k: np.frombuffer(mm, dtype=a['dtype'], count=a['count'], offset=a['offset'])
+        for k,a in header['arrays'].items()
+    }
+    return mm, header, arrays
+
+class MatchIndex:
+    """Read-only, memory-mapped name index for lookups.
+
+    The file holds a JSON header followed by flat arrays: the distinct strings of the
+    name/address columns as one UTF-8 buffer plus int64 character offsets, int32 codes
+    into them for every column of name_df, and for each source the COMPANY_ID of every
+    row in its nyffc.db table. Opening it only maps the file, so
+    processes share its pages and start without unpickling anything.
+    """
+
+    def __init__(self, path, **kwargs):
+        self._mm, self.header, self.arrays = map_arrays(path, MAGIC)
+        self.name_cols = self.header['name_cols']
+        self.addr_col = self.header['addr_col']
+        self.sources = self.header['sources']
+        # content hash of the index, changes whenever build_db writes a different one
+        self.version = self.header.get('version', '')
+
+        params = {
+            'threshold': self.header['threshold'],
+            'avg_threshold': self.header['avg_threshold'],
+            'fuzzy_alg': getattr(fuzz, self.header['fuzzy_alg']),
+            'engine': 'cdist',
+        }
+        params.update(kwargs)
+        self.match = FuzzyMatch(self.name_cols, self.addr_col, **params)
+        self._name_df = None
+        self._strings = None
+        self._address_index = None
+        self._name_strings = None
+        self.cache = None
+
+    @staticmethod
+    def write(path, name_df, source_ids, match):
+        """Write name_df (ordered by COMPANY_ID) and per-source COMPANY_IDs for a FuzzyMatch's columns"""
+        cols = match.name_cols + [match.addr_col]
+        name_df = encode_columns(name_df, cols)
+        strings = name_df[cols[0]].cat.categories.tolist()
+        arrays = {
+            'COMPANY_ID': name_df['COMPANY_ID'].values.astype('<i4'),
+            'strings.data': np.frombuffer(''.join(strings).encode('utf-8'), dtype=np.uint8),
+            'strings.offsets': np.concatenate([[0], np.cumsum([len(v) for v in strings])]).astype('<i8'),
+        }
+        for c in cols:
+            arrays[f'{c}.codes'] = name_df[c].cat.codes.values.astype('<i4')
+        for k,v in source_ids.items():
+            arrays[f'{k}.ids'] = np.asarray(v).astype('<i4')
+
+        header = {
+            'name_cols': match.name_cols,
+            'addr_col': match.addr_col,
+            'threshold': match.threshold,
+            'avg_threshold': match.avg_threshold,
+            'fuzzy_alg': match.fuzzy_alg.__name__,
+            'sources': list(source_ids),
+        }
+        h = hashlib.sha256(json.dumps(header, sort_keys=True).encode('utf-8'))
+        for k,a in arrays.items():
+            h.update(k.encode('utf-8'))
+            h.update(a.tobytes())
+        header['version'] = h.hexdigest()[:16]
+        write_arrays(path, MAGIC, header, arrays)
+
+    @property
+    def strings(self):
+        """Decoded distinct strings of the name/address columns, '' first"""
+        if self._strings is None:
+            text = self.arrays['strings.data'].tobytes().decode('utf-8')
+            offsets = self.arrays['strings.offsets']
+            self._strings = np.array([text[offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)], dtype=object)
+        return self._strings
+
+    def column(self, col):
+        """Decoded strings of a name/address column, in COMPANY_ID order"""
+        return self.strings[self.arrays[f'{col}.codes']]
+
+    @property
+    def name_df(self):
+        """name_df with dictionary-encoded name/address columns, decoding each distinct string once"""
+        if self._name_df is None:
+            dtype = pd.CategoricalDtype(self.strings)
+            self._name_df = pd.DataFrame({'COMPANY_ID': self.arrays['COMPANY_ID']})
+            for c in self.name_cols + [self.addr_col]:
+                self._name_df[c] = pd.Categorical.from_codes(self.arrays[f'{c}.codes'], dtype=dtype)
+        return self._name_df
+
+    @property
+    def address_index(self):
+        if self._address_index is None:
+            self._address_index = AddressIndex(self.arrays['COMPANY_ID'], self.column(self.addr_col))
+        return self._address_index
+
+    def _address_candidates(self, names, address):
+        """COMPANY_IDs on the street or in the zip code of an address-only query, None if it needs a full scan"""
+        if len(names)>0 or not address:
+            return None
+        ids = self.address_index.street(address)
+        return ids if len(ids)>0 else None
+
+    def source_ids(self, source):
+        """COMPANY_ID of every row of a source table, in table order"""
+        return self.arrays[f'{source}.ids']
+
+    def use_cache(self, db_path, max_entries=4096):
+        """Memoize lookups in a QueryCache kept in db_path, valid for this version of the index"""
+        params = [self.match.threshold, self.match.avg_threshold, self.match.fuzzy_alg.__name__]
+        self.cache = QueryCache(db_path, self.version, params, max_entries)
+
+    def get_matches(self, names = [], address = ''):
+        """Rows of each source matching the (normalized) names and address, keyed by source.
+
+        Address-only queries score just the rows on the same parsed street stem, in the same zip
+        code or at the same house number on the same street type, falling back to a full scan when
+        none of them match. They can still miss a row a full scan finds when its street, zip and
+        house number all differ from the query's.
+        """
+        return self.get_matches_batch([(names, address)])[0]
+
+    def cached(self, names = [], address = '', memory_only=False):
+        """get_matches from the cache, None when it is not cached or there is no cache.
+
+        memory_only looks in the in-memory LRU only, without touching nyffc.db.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.get(self.cache.key(names, address), self._source_rows, memory_only)
+
+    def get_matches_batch(self, queries):
+        """get_matches for a list of (names, address) queries, scored as one matrix apart from indexed address probes.
+
+        With use_cache, cached queries are answered without scoring and the rest are cached.
+        Returned DataFrames may then be shared between calls, so treat them as read-only.
+        """
+        results = [None]*len(queries)
+        keys = [None]*len(queries)
+        if self.cache is not None:
+            for i,(names,address) in enumerate(queries):
+                keys[i] = self.cache.key(names, address)
+                results[i] = self.cache.get(keys[i], self._source_rows)
+        todo = [i for i in range(len(queries)) if results[i] is None]
+        if len(todo)==0:
+            return results
+
+        for i,ids in zip(todo, self._match_ids([queries[i] for i in todo])):
+            results[i] = self._source_rows(ids)
+            if self.cache is not None:
+                self.cache.put(keys[i], ids, results[i])
+        return results
+
+    def _match_ids(self, queries):
+        """Matching COMPANY_IDs of each query"""
+        self.match.name_df = self.name_df
+        results = [None]*len(queries)
+        scan = []
+        for i,(names,address) in enumerate(queries):
+            candidates = self._address_candidates(names, address)
+            if candidates is None:
+                scan.append(i)
+            else:
+                results[i] = self.match._get_match_idx(names, address, candidates=candidates)
+                if len(results[i])==0:
+                    scan.append(i)
+        # a single scan needs no query matrix
+        if len(scan)==1:
+            names, address = queries[scan[0]]
+            results[scan[0]] = self.match._get_match_idx(names, address)
+        else:
+            for start in range(0, len(scan), BATCH_SIZE):
+                batch = scan[start:start+BATCH_SIZE]
+                for i,ids in zip(batch, self.match._get_match_idx_batch([queries[i] for i in batch])):
+                    results[i] = ids
+        return results
+
+    def search(self, text, cols=None):
+        """Rows of each source whose (normalized) name or address contains text, keyed by source.
+
+        A substring search for the app's search box, where get_matches would need a near-exact
+        name. cols defaults to the name columns; each distinct string is tested once.
+        """
+        if not text:
+            return {}
+        cols = self.name_cols if cols is None else cols
+        hit = np.fromiter((text in s for s in self.strings), dtype=bool, count=len(self.strings))
+        rows = np.logical_or.reduce([hit[self.arrays[f'{c}.codes']] for c in cols])
+        return self._source_rows(self.arrays['COMPANY_ID'][rows])
+
+    def search_address(self, text):
+        """Rows of each source at a (normalized) typed address, keyed by source.
+
+        The address is parsed and looked up in the AddressIndex on house number, street and zip
+        if given, so '1068 curry rd' finds 1068 curry road in any city. Text it cannot key, such
+        as a street without a house number, falls back to a substring search of the addresses.
+        """
+        ids = self.address_index.lookup(text) if text else []
+        if len(ids)==0:
+            return self.search(text, [self.addr_col])
+        return self._source_rows(ids)
+
+    @property
+    def name_strings(self):
+        """Distinct names of the name columns, as (codes into strings, smallest COMPANY_ID using each)"""
+        if self._name_strings is None:
+            codes = np.concatenate([self.arrays[f'{c}.codes'] for c in self.name_cols])
+            ids = np.tile(self.arrays['COMPANY_ID'], len(self.name_cols))
+            order = np.argsort(ids, kind='stable')
+            codes, first = np.unique(codes[order], return_index=True)
+            keep = codes != 0
+            self._name_strings = codes[keep], ids[order][first][keep]
+        return self._name_strings
+
+    def suggest(self, text, k=10, score_cutoff=85, min_length=2):
+        """Up to k (COMPANY_ID, name, score) for a partly typed (normalized) name, best first.
+
+        Scored with WRatio, which rewards prefixes, once per distinct name, so a name is
+        suggested once whichever rows use it.
+        """
+        if len(text) < min_length:
+            return []
+        codes, ids = self.name_strings
+        names = self.strings[codes]
+        score = process.cdist([text], names, scorer=rfuzz.WRatio, score_cutoff=score_cutoff)[0]
+        hits = np.nonzero(score)[0]
+        hits = hits[np.lexsort((names[hits], -score[hits]))][:k]
+        return [(int(ids[i]), names[i], float(score[i])) for i in hits]
+
+    def _source_rows(self, ids):
+        matches = {}
+        for source in self.sources:
+            src_ids = self.source_ids(source)
+            rows = np.nonzero(np.isin(src_ids, ids))[0]
+            if len(rows)>0:
+                df = pd.DataFrame({'ROW': rows, 'COMPANY_ID': src_ids[rows]})
+                for c in self.name_cols + [self.addr_col]:
+                    df[c] = self.strings[self.arrays[f'{c}.codes'][src_ids[rows]]]
+                matches[source] = df
+        return matches
@@ -0,0 +1,155 @@
+from mapping import concat_pairs, mean_score
+from match_index import map_arrays, write_arrays
+import argparse
+import numpy as np
+import pandas as pd
+
+MAGIC = b'NYFFCPS1'
+
+def mean_best(namescore, addrscore):
+    """Mean and best of name and address scores, ignoring a missing one, as FuzzyMatch._keep compares them"""
+    return mean_score(namescore, addrscore), np.fmax(namescore, addrscore)
+
+class PairScores:
+    """Name and address scores of every scored candidate pair that passes a score floor.
+
+    Pairs are kept in match table order, in both directions, as int32 COMPANY_IDs with
+    scores, NaN where a string is empty, in FuzzyMatch.score_dtype: float16 for the
+    integer scores of the rapidfuzz scorers, so 12 bytes per pair. Every threshold and
+    avg_threshold of at least the floor selects a subset of them, so re-thresholding is
+    a vectorized filter rather than a new match.
+    Scores too low to pass the floor may be stored as 0 (see FuzzyMatch.score_cutoff).
+    """
+
+    def __init__(self, a, b, namescore, addrscore, floor, nodes):
+        self.a = a
+        self.b = b
+        self.namescore = namescore
+        self.addrscore = addrscore
+        self.floor = floor
+        self.nodes = nodes
+        self._mean = None
+        self._best = None
+
+    @classmethod
+    def from_chunks(cls, chunks, floor, nodes, score_dtype=np.float16):
+        """PairScores over nodes COMPANY_IDs from FuzzyMatch.pairs"""
+        return cls(*concat_pairs(chunks, score_dtype), floor, nodes)
+
+    def extend(self, chunks, nodes):
+        """PairScores with the pairs of chunks appended, as after an incremental update"""
+        chunks = [(self.a, self.b, self.namescore, self.addrscore)] + list(chunks)
+        a, b, namescore, addrscore = concat_pairs(chunks, self.namescore.dtype)
+        return PairScores(a, b, namescore, addrscore, self.floor, nodes)
+
+    def drop(self, ids):
+        """PairScores without the pairs of COMPANY_IDs ids, in either column, as after their rows are matched again"""
+        keep = ~(np.isin(self.a, ids) | np.isin(self.b, ids))
+        return PairScores(self.a[keep], self.b[keep], self.namescore[keep], self.addrscore[keep], self.floor, self.nodes)
+
+    @classmethod
+    def open(cls, path):
+        mm, header, arrays = map_arrays(path, MAGIC)
+        pairs = cls(arrays['a'], arrays['b'], arrays['namescore'], arrays['addrscore'], header['floor'], header['nodes'])
+        pairs._mm = mm
+        return pairs
+
+    def save(self, path):
+        arrays = {
+            'a': self.a.astype('<i4'),
+            'b': self.b.astype('<i4'),
+            'namescore': self.namescore,
+            'addrscore': self.addrscore,
+        }
+        write_arrays(path, MAGIC, {'floor': self.floor, 'nodes': self.nodes, 'pairs': len(self)}, arrays)
+
+    def __len__(self):
+        return len(self.a)
+
+    def _scores(self):
+        if self._mean is None:
+            self._mean, self._best = mean_best(self.namescore, self.addrscore)
+        return self._mean, self._best
+
+    def _check(self, threshold, avg_threshold):
+        if threshold < self.floor or avg_threshold < self.floor:
+            raise ValueError(f'Pair scores were kept down to {self.floor}, thresholds must be at least that')
+
+    def keep(self, threshold, avg_threshold):
+        """Mask of the pairs FuzzyMatch would match with these thresholds"""
+        self._check(threshold, avg_threshold)
+        mean, best = self._scores()
+        return (mean >= avg_threshold) & (best >= threshold)
+
+    def match_df(self, threshold, avg_threshold):
+        """The match table FuzzyMatch would produce with these thresholds"""
+        keep = self.keep(threshold, avg_threshold)
+        return pd.DataFrame({
+            'MATCH_ID': np.arange(keep.sum(), dtype=np.int32),
+            'COMPANY_ID': self.a[keep],
+            'COMPANY_MATCH': self.b[keep],
+        })
+
+    def edge_scores(self, keep):
+        """Mean score of the kept pairs, as stored in the MatchGraph"""
+        return self._scores()[0][keep]
+
+    def lookup(self, a, b):
+        """(name score, address score) of pairs a[i], b[i], NaN for pairs that were not kept"""
+        query = np.asarray(a, dtype=np.int64)*self.nodes + np.asarray(b, dtype=np.int64)
+        namescore = np.full(len(query), np.nan, dtype=self.namescore.dtype)
+        addrscore = np.full(len(query), np.nan, dtype=self.addrscore.dtype)
+        if len(self)==0:
+            return namescore, addrscore
+        keys = self.a.astype(np.int64)*self.nodes + self.b
+        order = np.argsort(keys)
+        pos = order[np.minimum(np.searchsorted(keys[order], query), len(keys)-1)]
+        found = keys[pos]==query
+        namescore[found] = self.namescore[pos[found]]
+        addrscore[found] = self.addrscore[pos[found]]
+        return namescore, addrscore
+
+    def sweep(self, labels, thresholds, avg_thresholds):
+        """Precision and recall against labeled pairs for every threshold / avg_threshold combination.
+
+        labels has COMPANY_ID, COMPANY_MATCH and LABEL (true for pairs of the same company).
+        Labeled pairs that were never kept count as not matched at any threshold.
+        """
+        mean, best = mean_best(*self.lookup(labels['COMPANY_ID'].values, labels['COMPANY_MATCH'].values))
+        truth = labels['LABEL'].astype(bool).values
+        rows = []
+        for t in thresholds:
+            for avg in avg_thresholds:
+                self._check(t, avg)
+                predicted = (mean >= avg) & (best >= t)
+                tp = int((predicted & truth).sum())
+                fp = int((predicted & ~truth).sum())
+                fn = int((~predicted & truth).sum())
+                rows.append({
+                    'threshold': t,
+                    'avg_threshold': avg,
+                    'edges': int(self.keep(t, avg).sum()),
+                    'tp': tp,
+                    'fp': fp,
+                    'fn': fn,
+                    'precision': tp / (tp+fp) if tp+fp else np.nan,
+                    'recall': tp / (tp+fn) if tp+fn else np.nan,
+                })
+        out = pd.DataFrame(rows)
+        out['f1'] = 2*out['precision']*out['recall'] / (out['precision']+out['recall'])
+        return out
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precision/recall of match thresholds against labeled pairs, from stored pair scores')
+    parser.add_argument('labels', help='CSV of COMPANY_ID, COMPANY_MATCH, LABEL (1 for the same company, 0 otherwise)')
+    parser.add_argument('--pairs', default='data/out/pair_scores.bin')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[85, 90, 95, 100])
+    parser.add_argument('--avg-thresholds', type=float, nargs='+', default=[70, 75, 80, 85, 90])
+    parser.add_argument('--out', help='also save the sweep as CSV')
+    args = parser.parse_args()
+
+    pairs = PairScores.open(args.pairs)
+    out = pairs.sweep(pd.read_csv(args.labels), args.thresholds, args.avg_thresholds)
+    print(out.to_string(index=False))
+    if args.out:
+        out.to_csv(args.out, index=False)
@@ -0,0 +1,89 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import pandas as pd
+
+CACHE_DIR = 'data/cache/processed'
+# path -> [size, mtime_ns, sha256], so unchanged inputs are not hashed again
+FINGERPRINTS = 'fingerprints.json'
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def fingerprint(path, cache_dir=CACHE_DIR):
+    """sha256 of a file's contents, rehashed only when its size or mtime changed"""
+    index_path = os.path.join(cache_dir, FINGERPRINTS)
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    if key in index and index[key][:2] == [st.st_size, st.st_mtime_ns]:
+        return index[key][2]
+
+    index[key] = [st.st_size, st.st_mtime_ns, _sha256(path)]
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(index_path + '.tmp', index_path)
+    return index[key][2]
+
+def _read_raw(path):
+    """Parse a processed CSV or Excel file, with string dtype for columns of mixed values"""
+    if path.endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(path)
+    else:
+        df = pd.read_csv(path, low_memory=False)
+    for c in df.columns[df.dtypes == object]:
+        df[c] = df[c].astype(str).where(df[c].notna())
+    return df
+
+def parquet_path(path, digest, cache_dir=CACHE_DIR):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f'{stem}.{digest[:16]}.parquet')
+
+def to_parquet(path, cache_dir=CACHE_DIR):
+    """Write the typed Parquet copy of a processed file unless one of its current contents exists"""
+    out = parquet_path(path, fingerprint(path, cache_dir), cache_dir)
+    if os.path.exists(out):
+        return out
+    df = _read_raw(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    df.to_parquet(out + '.tmp', index=False)
+    os.replace(out + '.tmp', out)
+
+    # copies of earlier versions of the file are never read again
+    stem = os.path.basename(out).split('.')[0]
+    for f in os.listdir(cache_dir):
+        if f.startswith(stem + '.') and f.endswith('.parquet') and f != os.path.basename(out) and f.count('.') == 2:
+            os.remove(os.path.join(cache_dir, f))
+    return out
+
+def read_processed(path, cache_dir=CACHE_DIR):
+    """A processed CSV or Excel file as a DataFrame, read from its Parquet copy.
+
+    The CSV or Excel file is only parsed the first time its contents are seen.
+    """
+    return pd.read_parquet(to_parquet(path, cache_dir))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write Parquet copies of processed inputs, skipping unchanged files')
+    parser.add_argument('paths', nargs='*', help='processed CSV/Excel files, default every file in data/processed')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(
+        os.path.join('data/processed', f) for f in os.listdir('data/processed')
+        if f.endswith(('.csv', '.xlsx', '.xls'))
+    )
+    for path in paths:
+        t0 = time.time()
+        out = to_parquet(path, args.cache_dir)
+        print(f'{path} -> {out} ({time.time()-t0:.2f}s)')
@@ -0,0 +1,97 @@
+from intervals import parse_dates
+import json
+import pandas as pd
+
+# source -> (summary column, aggregate, source column); aggregates are count, sum, flag (any 'yes'),
+# first (earliest date) and last (latest date)
+SUMMARY = {
+    'REGISTRY': [
+        ('REGISTRATIONS', 'count', None),
+        ('REGISTRY_EXPIRES', 'last', 'Expiration Date'),
+        ('REGISTRY_DEBARRED', 'flag', 'Business has been debarred'),
+        ('OUTSTANDING_WAGE_ASSESSMENTS', 'flag', 'Business has outstanding wage assessments'),
+        ('LABOR_TAX_VIOLATION', 'flag', 'Business has final determination for violation of Labor or Tax Law'),
+        ('SAFETY_VIOLATION', 'flag', 'Business has final determination safety standard violations'),
+    ],
+    'DEBARMENT': [
+        ('DEBARMENTS', 'count', None),
+        ('DEBARRED_FROM', 'first', 'DEBAR_START'),
+        ('DEBARRED_UNTIL', 'last', 'DEBAR_END'),
+    ],
+    'APPRENTICE': [
+        ('APPRENTICE_PROGRAMS', 'count', None),
+    ],
+    'NYC_AWARDS': [
+        ('NYC_CONTRACTS', 'count', None),
+        ('NYC_PRIME_AMOUNT', 'sum', 'Prime Contract Current Amount'),
+        ('NYC_SUB_AMOUNT', 'sum', 'Sub Contract Current Amount'),
+        ('NYC_FIRST_START', 'first', 'Prime Contract Start Date'),
+        ('NYC_LAST_END', 'last', 'Prime Contract End Date'),
+    ],
+    'WAGE_THEFT': [
+        ('WAGE_THEFT_CASES', 'count', None),
+        ('WAGES_STOLEN', 'sum', 'wages_stolen'),
+        ('WAGE_THEFT_CLAIMANTS', 'sum', 'claimants'),
+        ('WAGE_THEFT_FIRST', 'first', 'date'),
+        ('WAGE_THEFT_LAST', 'last', 'date'),
+    ],
+    'USDOL': [
+        ('USDOL_CASES', 'count', None),
+        ('USDOL_VIOLATIONS', 'sum', 'case_violtn_cnt'),
+        ('USDOL_BACK_WAGES', 'sum', 'bw_atp_amt'),
+        ('USDOL_PENALTIES', 'sum', 'cmp_assd'),
+        ('USDOL_FIRST', 'first', 'findings_start_date'),
+        ('USDOL_LAST', 'last', 'findings_end_date'),
+    ],
+}
+
+def _summarize(df, spec):
+    """Aggregate one source's rows (with ENTITY_ID) into its summary columns, one row per entity"""
+    groups = df.groupby('ENTITY_ID')
+    out = {}
+    for name, how, col in spec:
+        if how == 'count':
+            out[name] = groups.size()
+        elif col not in df.columns:
+            continue
+        elif how == 'sum':
+            out[name] = pd.to_numeric(df[col], errors='coerce').groupby(df['ENTITY_ID']).sum()
+        elif how == 'flag':
+            out[name] = df[col].astype(str).str.strip().str.lower().eq('yes').groupby(df['ENTITY_ID']).any().astype(int)
+        else:
+            dates = parse_dates(df[col]).groupby(df['ENTITY_ID'])
+            dates = dates.min() if how == 'first' else dates.max()
+            out[name] = dates.dt.strftime('%Y-%m-%d')
+    return pd.DataFrame(out)
+
+def _records(df):
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+def entity_profiles(entity, members, name_df, sources):
+    """One denormalized profile per entity: member count, summary columns and a JSON PROFILE document.
+
+    entity maps COMPANY_ID -> ENTITY_ID, members is entity_members(entity), name_df the name
+    table and sources the source tables (with COMPANY_ID) keyed by source. PROFILE holds the
+    member name rows and every member row of each source, as served by the lookup service.
+    """
+    profile = members[['ENTITY_ID','SIZE']].set_index('ENTITY_ID')
+    docs = {e: {'names': [], 'sources': {}} for e in profile.index.tolist()}
+
+    names = name_df.merge(entity, on='COMPANY_ID')
+    for e,r in zip(names['ENTITY_ID'].tolist(), _records(names.drop(columns='ENTITY_ID'))):
+        docs[e]['names'].append(r)
+
+    for k,df in sources.items():
+        df = df.merge(entity, on='COMPANY_ID')
+        spec = SUMMARY.get(k, [(f'{k}_ROWS', 'count', None)])
+        profile = profile.join(_summarize(df, spec))
+        for name, how, _ in spec:
+            if name in profile.columns and how in ('count', 'sum', 'flag'):
+                profile[name] = profile[name].fillna(0)
+                if how != 'sum':
+                    profile[name] = profile[name].astype(int)
+        for e,r in zip(df['ENTITY_ID'].tolist(), _records(df.drop(columns='ENTITY_ID'))):
+            docs[e]['sources'].setdefault(k, []).append(r)
+
+    profile['PROFILE'] = [json.dumps(docs[e], default=str) for e in profile.index.tolist()]
+    return profile.reset_index()
@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+import json
+import resource
+import time
+import numpy as np
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _cpu_s():
+    """CPU time of this process plus finished child processes (pool workers)"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+class Profiler:
+    """Per-stage wall/CPU time and peak memory, plus named counters, for a build.
+
+    Stages nest, and a nested stage is reported as 'outer/inner'. count() adds to a
+    counter and observe() keeps count, sum and max of a distribution (e.g. candidates
+    per query).
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.counters = {}
+        self.observed = {}
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name):
+        self._stack.append(name)
+        path = '/'.join(self._stack)
+        wall, cpu = time.perf_counter(), _cpu_s()
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            self.stages.append({
+                'stage': path,
+                'wall_s': time.perf_counter() - wall,
+                'cpu_s': _cpu_s() - cpu,
+                'peak_rss_mb': _peak_rss_mb(),
+            })
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def observe(self, name, values):
+        values = np.asarray(values)
+        if len(values)==0:
+            return
+        obs = self.observed.setdefault(name, {'count': 0, 'sum': 0, 'max': 0})
+        obs['count'] += len(values)
+        obs['sum'] += int(values.sum())
+        obs['max'] = max(obs['max'], int(values.max()))
+
+    def merge(self, other):
+        """Add the counters and observations of another Profiler (e.g. from a pool worker)"""
+        for k,v in other.counters.items():
+            self.count(k, v)
+        for k,v in other.observed.items():
+            obs = self.observed.setdefault(k, {'count': 0, 'sum': 0, 'max': 0})
+            obs['count'] += v['count']
+            obs['sum'] += v['sum']
+            obs['max'] = max(obs['max'], v['max'])
+
+    def report(self):
+        return {
+            'stages': self.stages,
+            'counters': self.counters,
+            'observed': {
+                k: dict(v, mean=v['sum']/v['count'] if v['count'] else 0)
+                for k,v in self.observed.items()
+            },
+            'peak_rss_mb': _peak_rss_mb(),
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
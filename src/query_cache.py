@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from db import connect
+import json
+import sqlite3 as sql
+import sys
+import threading
+import numpy as np
+
+TABLE = 'query_cache'
+
+class QueryCache:
+    """Matching COMPANY_IDs of lookups, in a bounded in-memory LRU backed by a table in nyffc.db.
+
+    Entries are keyed on the normalized names and address plus the matcher's thresholds and
+    scorer, and tagged with the version of the index they were computed on. Opening the
+    cache drops entries of other versions, so a rebuilt index starts from an empty cache
+    while repeat lookups survive restarts of the service. Database errors, e.g. nyffc.db locked
+    by a build, are reported and make the table a miss (or skip storing), never a failed lookup.
+    """
+
+    def __init__(self, db_path, version, params, max_entries=4096):
+        self.version = version
+        self.params = params
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.stats = {'hits': 0, 'db_hits': 0, 'misses': 0, 'errors': 0}
+        self.lock = threading.Lock()
+        # lookups run on executor threads, the lock serializes use of the connection
+        self.conn = connect(db_path, check_same_thread=False)
+        with self.lock:
+            self._execute(f'CREATE TABLE IF NOT EXISTS {TABLE} (KEY TEXT PRIMARY KEY, VERSION TEXT, IDS TEXT)')
+            self._execute(f'DELETE FROM {TABLE} WHERE VERSION != ?', (version,))
+
+    def _execute(self, query, params=()):
+        """Run query with the lock held, reporting a database error and returning None instead of raising"""
+        try:
+            return self.conn.execute(query, params)
+        except sql.Error as e:
+            self.stats['errors'] += 1
+            print(f'query cache: {e}', file=sys.stderr)
+            return None
+
+    def key(self, names, address):
+        return json.dumps([sorted(set(names)), address, self.params])
+
+    def get(self, key, build, memory_only=False):
+        """Cached result for key, from memory or else built by build(ids) from the stored ids; None on a miss.
+
+        memory_only skips the table, for callers that must not block on disk and look there later.
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.stats['hits'] += 1
+                return self.memory[key]
+            if memory_only:
+                return None
+            cursor = self._execute(f'SELECT IDS FROM {TABLE} WHERE KEY=?', (key,))
+            row = None if cursor is None else cursor.fetchone()
+            self.stats['misses' if row is None else 'db_hits'] += 1
+        if row is None:
+            return None
+        value = build(np.array(json.loads(row[0]), dtype=int))
+        self._remember(key, value)
+        return value
+
+    def put(self, key, ids, value):
+        """Store the matching ids of a lookup and keep its result in memory"""
+        with self.lock:
+            self._execute(
+                f'INSERT OR REPLACE INTO {TABLE} VALUES (?, ?, ?)',
+                (key, self.version, json.dumps([int(i) for i in ids])),
+            )
+        self._remember(key, value)
+
+    def _remember(self, key, value):
+        with self.lock:
+            self.memory[key] = value
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def info(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.memory))
@@ -0,0 +1,100 @@
+from mapping import norm_series
+from match_index import BATCH_SIZE, MatchIndex
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import pandas as pd
+
+OUT_COLS = ['INPUT_ROW','QUERY_NAME','QUERY_ADDRESS','SOURCE','ROW','COMPANY_ID']
+
+def read_queries(path, name_cols, addr_cols, chunksize):
+    """Yield (first input row, [(names, address), ...]) per chunk of the vendor list, normalized"""
+    start = 0
+    for chunk in pd.read_csv(path, usecols=name_cols+addr_cols, dtype=str, chunksize=chunksize):
+        chunk = chunk.fillna('')
+        names = zip(*[norm_series(chunk[c]) for c in name_cols])
+        address = norm_series(chunk[addr_cols].agg(' '.join, axis=1)) if addr_cols else [''] * len(chunk)
+        yield start, [([n for n in ns if n], a) for ns,a in zip(names, address)]
+        start += len(chunk)
+
+class CSVWriter:
+
+    def __init__(self, f, cols):
+        self.cols = OUT_COLS + cols
+        self.writer = csv.writer(f)
+        self.writer.writerow(self.cols)
+
+    def write(self, row, query, matches):
+        for source,df in matches.items():
+            for r in df.itertuples(index=False):
+                r = r._asdict()
+                self.writer.writerow([row, ' | '.join(query[0]), query[1], source] + [r[c] for c in self.cols[4:]])
+
+class JSONLWriter:
+
+    def __init__(self, f, cols):
+        self.f = f
+
+    def write(self, row, query, matches):
+        self.f.write(json.dumps({
+            'row': row,
+            'names': query[0],
+            'address': query[1],
+            'matches': {k: v.to_dict('records') for k,v in matches.items()},
+        }) + '\n')
+
+def screen(index, path, out, name_cols, addr_cols=[], fmt='csv', chunksize=256, threads=os.cpu_count()):
+    """Match every row of a vendor CSV against the index, streaming results to out as chunks finish.
+
+    At most 2*threads chunks are read ahead of the writer, so memory does not grow with the input.
+    Each chunk is scored in batches of BATCH_SIZE rows, so chunksize only sets the work per thread.
+    """
+    writer = (JSONLWriter if fmt=='jsonl' else CSVWriter)(out, index.name_cols + [index.addr_col])
+    index.match.name_df = index.name_df
+    pending = deque()
+    rows = 0
+    t0 = time.time()
+
+    def drain():
+        nonlocal rows
+        start, queries, future = pending.popleft()
+        for i,(query,matches) in enumerate(zip(queries, future.result())):
+            writer.write(start+i, query, matches)
+        rows += len(queries)
+        print(f'\r{rows} rows, {rows/(time.time()-t0):.0f} rows/s', end='', file=sys.stderr)
+
+    with ThreadPoolExecutor(threads) as pool:
+        for start,queries in read_queries(path, name_cols, addr_cols, chunksize):
+            pending.append((start, queries, pool.submit(index.get_matches_batch, queries)))
+            if len(pending) >= 2*threads:
+                drain()
+        while pending:
+            drain()
+    print(file=sys.stderr)
+    return rows, time.time()-t0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Screen a vendor list against every source')
+    parser.add_argument('input', help='vendor CSV')
+    parser.add_argument('output', help='results file, - for stdout')
+    parser.add_argument('--name-col', action='append', required=True, help='name column, may be repeated (e.g. name and DBA)')
+    parser.add_argument('--address-col', action='append', default=[], help='address column, repeated columns are joined in order')
+    parser.add_argument('--format', choices=['csv','jsonl'], default='csv')
+    parser.add_argument('--index', default='data/out/match_index.bin')
+    parser.add_argument('--chunksize', type=int, default=256, help=f'rows read and matched per thread task, scored {BATCH_SIZE} at a time')
+    parser.add_argument('--threads', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    index = MatchIndex(args.index)
+    out = sys.stdout if args.output=='-' else open(args.output, 'w', newline='')
+    try:
+        rows, elapsed = screen(index, args.input, out, args.name_col, args.address_col, args.format, args.chunksize, args.threads)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f'Screened {rows} rows in {elapsed:.1f}s ({rows/max(elapsed, 1e-9):.0f} rows/s)', file=sys.stderr)
@@ -0,0 +1,239 @@
+from intervals import overlapping
+from mapping import norm_string
+from match_graph import MatchGraph
+from match_index import BATCH_SIZE, MatchIndex
+import argparse
+import asyncio
+import json
+import sqlite3 as sql
+from urllib.parse import parse_qs, urlsplit
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+class LookupService:
+    """Local HTTP/JSON lookup service over one shared MatchIndex.
+
+    Match requests that arrive within window seconds of each other (up to max_batch)
+    are scored together in one matrix pass on a worker thread. Lookups are cached in
+    nyffc.db (see QueryCache). Lookups in its in-memory LRU are answered without waiting for
+    a batch; the rest look in nyffc.db on the worker thread, with the batch.
+
+    Endpoints:
+        GET  /info                                 columns, sources, batching and cache stats
+        GET  /match?name=..&name=..&address=..     matching rows per source
+        POST /match {"names": [..], "address": ..}
+        GET  /profile?company_id=..                summary and every source row of the company's entity
+        GET  /neighbors?company_id=..              direct matches of the company, with scores
+        GET  /search?q=..&field=name|address       rows per source whose name contains q, or at address q
+        GET  /suggest?q=..&k=..                    top-k names for a partly typed name
+        GET  /intervals?start=..&end=..&kind=..    debarments, contracts, findings, .. active on start or during
+                                                   start..end; with &company_id=.. only those of its entity
+    """
+
+    def __init__(self, index_path, db_path, graph_path, window=0.005, max_batch=BATCH_SIZE, cache_size=4096):
+        self.index = MatchIndex(index_path)
+        if cache_size > 0:
+            self.index.use_cache(db_path, cache_size)
+        self.graph = MatchGraph.open(graph_path)
+        self.db_path = db_path
+        self.window = window
+        self.max_batch = max_batch
+        self.stats = {'requests': 0, 'batches': 0}
+        self.queue = None
+
+    async def match(self, names, address):
+        # the event loop must not block on sqlite, the batch looks in nyffc.db
+        cached = self.index.cached(names, address, memory_only=True)
+        if cached is not None:
+            return cached
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((names, address, future))
+        return await future
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.stats['requests'] += len(batch)
+            self.stats['batches'] += 1
+            try:
+                results = await loop.run_in_executor(
+                    None, self.index.get_matches_batch, [(names, address) for names,address,_ in batch]
+                )
+            except Exception as e:
+                for *_,future in batch:
+                    future.set_exception(e)
+                continue
+            for (*_,future),result in zip(batch, results):
+                future.set_result(result)
+
+    def profile(self, company_id):
+        """Materialized profile of the entity of company_id: summary plus the rows of every source"""
+        conn = sql.connect(self.db_path)
+        try:
+            conn.row_factory = sql.Row
+            row = conn.execute(
+                'SELECT p.* FROM entity e JOIN entity_profile p ON p.ENTITY_ID=e.ENTITY_ID WHERE e.COMPANY_ID=?',
+                (company_id,),
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        row = dict(row)
+        doc = json.loads(row.pop('PROFILE'))
+        return {
+            'company_id': company_id,
+            'entity_id': row.pop('ENTITY_ID'),
+            'summary': row,
+            'names': doc['names'],
+            'sources': doc['sources'],
+        }
+
+    def intervals(self, start, end=None, company_id=None, kinds=None):
+        """Date intervals overlapping start..end, of the entity of company_id or of every entity"""
+        conn = sql.connect(self.db_path)
+        try:
+            entity_id = None
+            if company_id is not None:
+                row = conn.execute('SELECT ENTITY_ID FROM entity WHERE COMPANY_ID=?', (company_id,)).fetchone()
+                if row is None:
+                    return None
+                entity_id = row[0]
+            return overlapping(conn, start, end, entity_id, kinds)
+        finally:
+            conn.close()
+
+    def neighbors(self, company_id):
+        """COMPANY_IDs matched to company_id and their scores, read from the match graph"""
+        ids = self.graph.neighbors_of(company_id)
+        scores = self.graph.scores_of(company_id)
+        return {
+            'company_id': company_id,
+            'neighbors': ids.tolist(),
+            'scores': None if scores is None else scores.tolist(),
+        }
+
+    async def route(self, method, path, params, body):
+        if path == '/info':
+            return 200, {
+                'name_cols': self.index.name_cols,
+                'addr_col': self.index.addr_col,
+                'sources': self.index.sources,
+                'stats': self.stats,
+                'cache': None if self.index.cache is None else self.index.cache.info(),
+            }
+        if path == '/match':
+            if method == 'POST':
+                query = json.loads(body or b'{}')
+                names, address = query.get('names', []), query.get('address', '')
+            else:
+                names, address = params.get('name', []), params.get('address', [''])[0]
+            names = [norm_string(n) for n in names]
+            matches = await self.match(names, norm_string(address))
+            return 200, {'matches': {k: v.to_dict('records') for k,v in matches.items()}}
+        if path == '/profile':
+            profile = self.profile(int(params['company_id'][0]))
+            if profile is None:
+                return 404, {'error': 'Unknown company_id'}
+            return 200, profile
+        if path == '/search':
+            text = norm_string(params.get('q', [''])[0])
+            field = params.get('field', ['name'])[0]
+            if field not in ('name', 'address'):
+                return 400, {'error': f"Unknown field '{field}', expected 'name' or 'address'"}
+            search = self.index.search if field == 'name' else self.index.search_address
+            matches = await asyncio.get_running_loop().run_in_executor(None, search, text)
+            return 200, {'matches': {k: v.to_dict('records') for k,v in matches.items()}}
+        if path == '/suggest':
+            text = norm_string(params.get('q', [''])[0])
+            k = int(params.get('k', ['10'])[0])
+            hits = await asyncio.get_running_loop().run_in_executor(None, self.index.suggest, text, k)
+            return 200, {'suggestions': [{'COMPANY_ID': i, 'name': n, 'score': s} for i,n,s in hits]}
+        if path == '/intervals':
+            company_id = params.get('company_id')
+            intervals = self.intervals(
+                params['start'][0], params.get('end', [None])[0],
+                None if company_id is None else int(company_id[0]), params.get('kind'),
+            )
+            if intervals is None:
+                return 404, {'error': 'Unknown company_id'}
+            return 200, {'intervals': intervals.to_dict('records')}
+        if path == '/neighbors':
+            company_id = int(params['company_id'][0])
+            if not 0 <= company_id < len(self.graph):
+                return 404, {'error': 'Unknown company_id'}
+            return 200, self.neighbors(company_id)
+        return 404, {'error': f'Unknown path {path}'}
+
+    async def handle(self, reader, writer):
+        try:
+            method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                k,v = line.decode('latin-1').split(':', 1)
+                headers[k.strip().lower()] = v.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            url = urlsplit(target)
+            if method not in ('GET', 'POST'):
+                status, payload = 405, {'error': f'Method {method} not allowed'}
+            else:
+                status, payload = await self.route(method, url.path, parse_qs(url.query), body)
+        except (ValueError, KeyError) as e:
+            status, payload = 400, {'error': str(e)}
+        except Exception as e:
+            status, payload = 500, {'error': str(e)}
+
+        data = json.dumps(payload, default=str).encode('utf-8')
+        writer.write(
+            f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+            f'Content-Type: application/json\r\n'
+            f'Content-Length: {len(data)}\r\n'
+            f'Connection: close\r\n\r\n'.encode('latin-1') + data
+        )
+        await writer.drain()
+        writer.close()
+
+    async def serve(self, host, port):
+        self.queue = asyncio.Queue()
+        batcher = asyncio.create_task(self._batcher())
+        # decode the mapped strings and parse addresses before the first request rather than during it
+        self.index.match.name_df = self.index.name_df
+        self.index.address_index
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f'Serving lookups on http://{host}:{port}')
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                batcher.cancel()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local contractor lookup service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--index', default='data/out/match_index.bin')
+    parser.add_argument('--db', default='data/out/nyffc.db')
+    parser.add_argument('--graph', default='data/out/match_graph.bin')
+    parser.add_argument('--window-ms', type=float, default=5, help='how long to wait for more requests to batch')
+    parser.add_argument('--max-batch', type=int, default=BATCH_SIZE)
+    parser.add_argument('--cache-size', type=int, default=4096, help='lookups kept in memory, 0 disables the query cache')
+    args = parser.parse_args()
+
+    service = LookupService(
+        args.index, args.db, args.graph, window=args.window_ms/1000, max_batch=args.max_batch, cache_size=args.cache_size,
+    )
+    asyncio.run(service.serve(args.host, args.port))
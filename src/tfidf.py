@@ -0,0 +1,79 @@
+import numpy as np
+import scipy.sparse as sp
+
+MIN_DF_CAP = 100
+
+def char_ngrams(s, n):
+    """Character n-grams of a string padded with a space on each side"""
+    s = f' {s} '
+    return [s[i:i+n] for i in range(max(len(s)-n, 0)+1)]
+
+class TfidfIndex:
+    """Character n-gram TF-IDF vectors of a list of strings, for top-n cosine neighbor search.
+
+    Rows are L2-normalized, so the sparse product of two matrices holds cosine similarities.
+    n-grams found in more than max_df of the strings (e.g. 'inc', 'con') are dropped: they
+    barely move the scores but dominate the cost of the products. Small inputs keep
+    n-grams shared by up to MIN_DF_CAP strings.
+    """
+
+    def __init__(self, strings, ngram=3, max_df=0.05):
+        self.ngram = ngram
+        self.vocab = {}
+        for s in strings:
+            for g in (char_ngrams(s, ngram) if s else []):
+                self.vocab.setdefault(g, len(self.vocab))
+        # document frequency: sum_duplicates leaves each (string, n-gram) once
+        df = np.bincount(self._counts(strings).indices, minlength=len(self.vocab))
+        keep = df <= max(max_df*len(strings), MIN_DF_CAP)
+        self.vocab = {g: j for j,g in enumerate(g for g,i in self.vocab.items() if keep[i])}
+        self.idf = (np.log((1+len(strings)) / (1+df[keep])) + 1).astype(np.float32)
+        self.matrix = self.transform(strings)
+        self._matrix_t = self.matrix.T.tocsr()
+
+    def _counts(self, strings):
+        """Sparse n-gram counts over the vocabulary"""
+        indptr, indices = [0], []
+        for s in strings:
+            for g in (char_ngrams(s, self.ngram) if s else []):
+                i = self.vocab.get(g)
+                if i is not None:
+                    indices.append(i)
+            indptr.append(len(indices))
+        m = sp.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), np.array(indices, dtype=np.int64), np.array(indptr)),
+            shape=(len(strings), len(self.vocab)),
+        )
+        m.sum_duplicates()
+        return m
+
+    def transform(self, strings):
+        """L2-normalized TF-IDF rows of strings; n-grams outside the vocabulary are ignored"""
+        m = self._counts(strings)
+        m.data = (1 + np.log(m.data)) * self.idf[m.indices]
+        norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sp.csr_matrix(sp.diags(1/norms) @ m, dtype=np.float32)
+
+    def top_n(self, queries, n=20, cutoff=0.5, chunk_size=1024):
+        """(query row, string row, cosine) of up to n neighbors per query row above cutoff.
+
+        queries is a matrix from transform(). The product runs chunk_size query rows at a
+        time, so memory is bounded by one chunk of similarities however many rows there are.
+        """
+        rows, cols, scores = [], [], []
+        for s in range(0, queries.shape[0], chunk_size):
+            sim = (queries[s:s+chunk_size] @ self._matrix_t).tocoo()
+            keep = sim.data >= cutoff
+            r, c, v = sim.row[keep], sim.col[keep], sim.data[keep]
+            # rank neighbors within each query row, best first
+            order = np.lexsort((-v, r))
+            r, c, v = r[order], c[order], v[order]
+            starts = np.searchsorted(r, r, side='left')
+            keep = np.arange(len(r)) - starts < n
+            rows.append(r[keep] + s)
+            cols.append(c[keep])
+            scores.append(v[keep])
+        if len(rows) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        return np.concatenate(rows).astype(np.int64), np.concatenate(cols).astype(np.int64), np.concatenate(scores)
@@ -0,0 +1,30 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+# build_db and the loaders resolve data/processed relative to the repo root
+os.chdir(ROOT)
+
+@pytest.fixture(scope='session')
+def sources():
+    """The bundled processed sources, loaded as build_db loads them"""
+    import build_db
+    return {k: build_db.load(build_db.Profiler(), [k])[k] for k in ['REGISTRY', 'DEBARMENT', 'WAGE_THEFT', 'USDOL']}
+
+def sample(sources, n):
+    """Copies of the first n rows of each source by name (USDOL has only addresses), so rows of
+    different sources share prefixes and match each other"""
+    return {
+        k: v.sort_values('NAME1' if 'NAME1' in v.columns else 'ADDRESS').head(n).reset_index(drop=True)
+        for k,v in sources.items()
+    }
+
+def edges(sources, n=60, **kwargs):
+    """(COMPANY_ID, COMPANY_MATCH) pairs of a FuzzyMatch over sample(sources, n), at thresholds low
+    enough for a sample this small to have matches"""
+    from mapping import FuzzyMatch
+    match = FuzzyMatch(['NAME1','NAME2'], 'ADDRESS', **dict({'threshold': 85, 'avg_threshold': 70}, **kwargs))
+    match_df, _ = match.index_and_match(sample(sources, n))
+    return set(zip(match_df['COMPANY_ID'], match_df['COMPANY_MATCH']))
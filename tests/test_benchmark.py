@@ -0,0 +1,21 @@
+from mapping import FuzzyMatch
+from match_index import BATCH_SIZE
+import time
+
+def test_batched_lookups_beat_single(sources):
+    match = FuzzyMatch(['NAME1','NAME2'], 'ADDRESS', engine='cdist')
+    match.name_df, _ = match._company_indexes({k: v.copy() for k,v in sources.items()})
+    rows = match.name_df.sample(4*BATCH_SIZE, random_state=0)
+    queries = [([n for n in (r.NAME1, r.NAME2) if n], r.ADDRESS if i%2 else '') for i,r in enumerate(rows.itertuples())]
+    # score once first, so neither timing pays for the distinct string index
+    match._get_match_idx_batch(queries[:2])
+
+    start = time.perf_counter()
+    single = [match._get_match_idx(*q) for q in queries]
+    single_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batched = [ids for i in range(0, len(queries), BATCH_SIZE) for ids in match._get_match_idx_batch(queries[i:i+BATCH_SIZE])]
+    batched_time = time.perf_counter() - start
+
+    assert [sorted(ids) for ids in batched] == [sorted(ids) for ids in single]
+    assert batched_time <= single_time
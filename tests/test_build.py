@@ -0,0 +1,113 @@
+from conftest import sample
+from mapping import FuzzyMatch
+from match_graph import MatchGraph
+from match_index import MatchIndex
+import numpy as np
+import build_db
+import pandas as pd
+import pytest
+
+@pytest.fixture
+def frames(sources, monkeypatch):
+    """Sampled sources that build_db loads in place of the processed files, fingerprinted by content"""
+    frames = sample(sources, 80)
+    monkeypatch.setattr(build_db, 'SOURCES', {k: (k, lambda path: frames[path].copy()) for k in frames})
+    monkeypatch.setattr(build_db, 'fingerprint', lambda path: str(pd.util.hash_pandas_object(frames[path]).sum()))
+    return frames
+
+def connect(tmp_path, monkeypatch, name):
+    """Connection to a database in tmp_path/name, with its index, graph and pair scores next to it"""
+    (tmp_path / name).mkdir()
+    for k in ['DB_PATH', 'INDEX_PATH', 'GRAPH_PATH', 'PAIRS_PATH']:
+        monkeypatch.setattr(build_db, k, str(tmp_path / name / getattr(build_db, k).split('/')[-1]))
+    return build_db.connect(build_db.DB_PATH)
+
+def fuzzy_match(threshold=95, avg_threshold=80, score_floor=70, block_size=100):
+    return FuzzyMatch(
+        ['NAME1','NAME2'], 'ADDRESS', threshold=threshold, avg_threshold=avg_threshold,
+        block_size=block_size, engine='cdist', score_floor=score_floor,
+    )
+
+def named_edges(conn):
+    """Match edges as pairs of name rows, comparable between builds that number rows differently"""
+    name = pd.read_sql('SELECT * FROM name', conn).set_index('COMPANY_ID')
+    match = pd.read_sql('SELECT * FROM match', conn)
+    key = lambda i: tuple(name.loc[i])
+    return set((key(a), key(b)) for a,b in zip(match['COMPANY_ID'], match['COMPANY_MATCH']))
+
+def named_entities(conn):
+    """Entities as sets of name rows"""
+    name = pd.read_sql('SELECT * FROM name', conn).set_index('COMPANY_ID')
+    entity = pd.read_sql('SELECT * FROM entity', conn)
+    return set(frozenset(tuple(name.loc[i]) for i in g['COMPANY_ID']) for _,g in entity.groupby('ENTITY_ID'))
+
+def assert_update_matches_build(frames, tmp_path, monkeypatch, before, after, block_size=100):
+    """Build from the before sources and update to the after ones, then compare with a build from after.
+    Returns the update's FuzzyMatch."""
+    frames.update(before)
+    conn = connect(tmp_path, monkeypatch, 'incremental')
+    build_db.build(conn, fuzzy_match(block_size=block_size))
+    frames.update(after)
+    match = fuzzy_match(block_size=block_size)
+    build_db.update(conn, match)
+
+    full = connect(tmp_path, monkeypatch, 'full')
+    build_db.build(full, fuzzy_match(block_size=block_size))
+    assert len(named_edges(conn)) > 0
+    assert named_edges(conn) == named_edges(full)
+    assert named_entities(conn) == named_entities(full)
+    return match
+
+def test_incremental_matches_full_build(frames, tmp_path, monkeypatch):
+    registry = frames['REGISTRY']
+    assert_update_matches_build(frames, tmp_path, monkeypatch, {'REGISTRY': registry.head(50)}, {'REGISTRY': registry})
+
+def test_incremental_rematches_blocks_crossing_block_size(frames, tmp_path, monkeypatch):
+    registry = frames['REGISTRY']
+    match = assert_update_matches_build(
+        frames, tmp_path, monkeypatch, {'REGISTRY': registry.head(50)}, {'REGISTRY': registry}, block_size=8,
+    )
+    assert match.profiler.counters['rows_rematched'] > 0
+
+def test_incremental_drops_unreferenced_rows(frames, tmp_path, monkeypatch):
+    registry, wage_theft = frames['REGISTRY'], frames['WAGE_THEFT']
+    assert_update_matches_build(
+        frames, tmp_path, monkeypatch, {}, {'REGISTRY': registry.iloc[10:], 'WAGE_THEFT': wage_theft.iloc[::2]}, block_size=8,
+    )
+
+def test_rethreshold_matches_fresh_match(frames, tmp_path, monkeypatch):
+    conn = connect(tmp_path, monkeypatch, 'rethreshold')
+    build_db.build(conn, fuzzy_match())
+    build_db.rethreshold(conn, fuzzy_match(85, 75))
+    assert build_db.stored_params(conn) == {'threshold': 85, 'avg_threshold': 75, 'score_floor': 70}
+
+    fresh = connect(tmp_path, monkeypatch, 'fresh')
+    build_db.build(fresh, fuzzy_match(85, 75, None))
+    query = 'SELECT * FROM match ORDER BY MATCH_ID'
+    assert pd.read_sql(query, conn).equals(pd.read_sql(query, fresh))
+
+def test_graph_scores_from_pair_scores_match_rescoring(frames, tmp_path, monkeypatch):
+    graphs = []
+    for name, floor in [('pairs', 70), ('rescored', None)]:
+        conn = connect(tmp_path, monkeypatch, name)
+        build_db.build(conn, fuzzy_match(score_floor=floor))
+        graphs.append(MatchGraph.open(build_db.GRAPH_PATH))
+    pairs, rescored = graphs
+    assert np.array_equal(pairs.offsets, rescored.offsets)
+    assert np.array_equal(pairs.neighbors, rescored.neighbors)
+    assert np.array_equal(pairs.scores, rescored.scores, equal_nan=True)
+
+def test_update_refuses_other_thresholds(frames, tmp_path, monkeypatch):
+    conn = connect(tmp_path, monkeypatch, 'params')
+    build_db.build(conn, fuzzy_match())
+    with pytest.raises(ValueError):
+        build_db.update(conn, fuzzy_match(90, 75))
+
+def test_suggest_ranks_exact_name_first(frames, tmp_path, monkeypatch):
+    conn = connect(tmp_path, monkeypatch, 'suggest')
+    build_db.build(conn, fuzzy_match())
+    index = MatchIndex(build_db.INDEX_PATH)
+    for name in [n for n in index.column('NAME1') if n][-5:]:
+        hits = index.suggest(name, k=5)
+        assert hits[0][1:] == (name, 100.0)
+        assert len(set(n for _,n,_ in hits)) == len(hits)
@@ -0,0 +1,21 @@
+from conftest import edges
+import pytest
+
+ENGINES = {
+    'cdist': {'engine': 'cdist', 'workers': -1},
+    'pool': {'engine': 'cdist', 'processes': 2, 'chunk_size': 40},
+    # with no cosine cutoff every pair that can match is among the top_n neighbors of a sample this small
+    'tfidf': {'engine': 'tfidf', 'tfidf_cutoff': 0},
+}
+
+@pytest.fixture(scope='module')
+def apply_edges(sources):
+    return edges(sources, 80, engine='apply')
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_engine_matches_apply(sources, apply_edges, engine):
+    assert len(apply_edges) > 0
+    assert edges(sources, 80, **ENGINES[engine]) == apply_edges
+
+def test_tfidf_cutoff_only_drops_edges(sources, apply_edges):
+    assert edges(sources, 80, engine='tfidf') <= apply_edges
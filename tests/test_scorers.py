@@ -0,0 +1,10 @@
+from conftest import edges
+from fuzzywuzzy import fuzz
+from mapping import RAPIDFUZZ_SCORERS
+import pytest
+
+@pytest.mark.parametrize('fuzzy_alg', list(RAPIDFUZZ_SCORERS) + [fuzz.partial_ratio, fuzz.WRatio])
+def test_cdist_matches_apply(sources, fuzzy_alg):
+    apply = edges(sources, fuzzy_alg=fuzzy_alg, engine='apply')
+    assert any(a != b for a,b in apply)
+    assert edges(sources, fuzzy_alg=fuzzy_alg, engine='cdist') == apply